@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from accounts.outbox import OUTBOX_BATCH_SIZE, claim_batch, deliver
+
+
+class Command(BaseCommand):
+    help = "Deliver queued emails in batches over a shared SMTP connection"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=float, default=2.0,
+                            help="Seconds to wait when the outbox is empty")
+        parser.add_argument('--batch', type=int, default=OUTBOX_BATCH_SIZE,
+                            help="Messages sent per SMTP connection")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the outbox is empty")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Outbox worker started")
+        while True:
+            close_old_connections()
+
+            messages = claim_batch(options['batch'])
+            if not messages:
+                if options['once']:
+                    return
+                time.sleep(options['poll'])
+                continue
+
+            sent = deliver(messages)
+            self.stdout.write(f"Sent {sent} of {len(messages)} emails")
@@ -0,0 +1,86 @@
+from datetime import timedelta
+from typing import List
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import OutboxMessage
+
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 5
+# A claimed batch is hidden from other workers for this long
+OUTBOX_LEASE = timedelta(minutes=5)
+OUTBOX_RETRY_BASE = timedelta(minutes=1)
+
+
+def enqueue_email(to, subject, body, html_body="") -> OutboxMessage:
+    """Queue an email, the request does not wait for SMTP"""
+    return OutboxMessage.objects.create(to=to, subject=subject, body=body,
+                                        html_body=html_body)
+
+
+def claim_batch(limit=OUTBOX_BATCH_SIZE) -> List[OutboxMessage]:
+    """Take due messages, leasing them so a second worker skips them"""
+    now = timezone.now()
+    with transaction.atomic():
+        due = OutboxMessage.objects.filter(
+            status=OutboxMessage.PENDING, next_attempt_at__lte=now
+        ).order_by('next_attempt_at')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        messages = list(due[:limit])
+        OutboxMessage.objects.filter(
+            id__in=[message.id for message in messages]
+        ).update(next_attempt_at=now + OUTBOX_LEASE)
+    return messages
+
+
+def _as_email(message, mail_connection):
+    email = EmailMultiAlternatives(
+        message.subject, message.body,
+        settings.DEFAULT_FROM_EMAIL or 'webmaster@localhost', [message.to],
+        connection=mail_connection)
+    if message.html_body:
+        email.attach_alternative(message.html_body, "text/html")
+    return email
+
+
+def _failed(message, error):
+    message.attempts += 1
+    message.last_error = str(error)
+    if message.attempts >= OUTBOX_MAX_ATTEMPTS:
+        message.status = OutboxMessage.FAILED
+    else:
+        message.next_attempt_at = timezone.now() + \
+            OUTBOX_RETRY_BASE * 2 ** (message.attempts - 1)
+
+
+def deliver(messages: List[OutboxMessage]) -> int:
+    """Send a batch over one SMTP connection, returning how many went out"""
+    if not messages:
+        return 0
+
+    mail_connection = get_connection()
+    try:
+        mail_connection.open()
+    except Exception as e:
+        for message in messages:
+            _failed(message, e)
+    else:
+        try:
+            for message in messages:
+                try:
+                    _as_email(message, mail_connection).send()
+                except Exception as e:
+                    _failed(message, e)
+                else:
+                    message.status = OutboxMessage.SENT
+                    message.sent_at = timezone.now()
+                    message.attempts += 1
+        finally:
+            mail_connection.close()
+
+    OutboxMessage.objects.bulk_update(
+        messages, ['status', 'attempts', 'last_error', 'next_attempt_at',
+                   'sent_at'])
+    return sum(message.status == OutboxMessage.SENT for message in messages)
@@ -1,3 +1,82 @@
+from datetime import timedelta
+from unittest import mock
+from django.core import mail
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from .models import CustomUser, OutboxMessage
+from .outbox import (OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE, claim_batch,
+                     deliver, enqueue_email)
 
-# Create your tests here.
+
+class SignupTests(TestCase):
+    def test_signup_queues_verification_email(self):
+        # Email uniqueness check, the user and the outbox row; no SMTP
+        with self.assertNumQueries(3):
+            response = self.client.post(reverse('signup'), {
+                'email': 'new@example.com',
+                'password1': 'a-Long-passphrase-42',
+                'password2': 'a-Long-passphrase-42',
+            })
+
+        self.assertRedirects(response, reverse('login'))
+        self.assertFalse(CustomUser.objects.get(
+            email='new@example.com').is_active)
+        self.assertEqual(len(mail.outbox), 0)
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.to, 'new@example.com')
+        self.assertIn('/accounts/verify-email/', message.body)
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.message = enqueue_email('student@example.com', 'Hello', 'Body')
+
+    def make_due(self):
+        OutboxMessage.objects.update(next_attempt_at=timezone.now())
+
+    def test_delivers_and_leases_the_batch(self):
+        messages = claim_batch()
+        # Leased, so another worker's claim skips it
+        self.assertEqual(claim_batch(), [])
+
+        self.assertEqual(deliver(messages), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, OutboxMessage.SENT)
+        self.assertEqual(self.message.attempts, 1)
+        self.assertIsNotNone(self.message.sent_at)
+
+    @mock.patch('accounts.outbox.EmailMultiAlternatives.send',
+                side_effect=OSError("relay refused"))
+    def test_failures_back_off_then_give_up(self, send):
+        delays = []
+        for _ in range(OUTBOX_MAX_ATTEMPTS):
+            self.make_due()
+            started = timezone.now()
+            self.assertEqual(deliver(claim_batch()), 0)
+            self.message.refresh_from_db()
+            delays.append(self.message.next_attempt_at - started)
+
+        self.assertEqual(self.message.status, OutboxMessage.FAILED)
+        self.assertEqual(self.message.attempts, OUTBOX_MAX_ATTEMPTS)
+        self.assertEqual(self.message.last_error, "relay refused")
+        # Each retry waits twice as long as the one before
+        for attempt, delay in enumerate(delays[:-1]):
+            expected = OUTBOX_RETRY_BASE * 2 ** attempt
+            self.assertLess(abs(delay - expected), timedelta(seconds=5))
+
+        self.make_due()
+        self.assertEqual(claim_batch(), [])
+
+    def test_connection_failure_fails_the_whole_batch(self):
+        enqueue_email('other@example.com', 'Hello', 'Body')
+        connection = mock.Mock()
+        connection.open.side_effect = ConnectionRefusedError("no SMTP")
+        with mock.patch('accounts.outbox.get_connection',
+                        return_value=connection):
+            self.assertEqual(deliver(claim_batch()), 0)
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(list(OutboxMessage.objects.values_list(
+            'status', 'attempts')), [(OutboxMessage.PENDING, 1)] * 2)
@@ -1,10 +1,9 @@
-from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.contrib.auth.tokens import default_token_generator
-from django.conf import settings
 from django.urls import reverse
+from .outbox import enqueue_email
 
 
 def send_verification_email(request, user):
@@ -34,12 +33,6 @@ def send_verification_email(request, user):
         'verification_url': verification_url,
     })
 
-    # Create email with both plain text and HTML versions
-    msg = EmailMultiAlternatives(
-        subject,
-        text_content,
-        settings.DEFAULT_FROM_EMAIL or 'webmaster@localhost',
-        [user.email]
-    )
-    msg.attach_alternative(html_content, "text/html")
-    msg.send()
\ No newline at end of file
+    # Queued rather than sent, send_outbox delivers it over a pooled
+    # connection so signup never waits on SMTP
+    enqueue_email(user.email, subject, text_content, html_content)
@@ -0,0 +1,374 @@
+# Summarization and card generation against the upstream APIs, over the
+# pooled httpx client. This is the only implementation: the sync entry points
+# in utils run these coroutines through async_to_sync. Chunking, prompts and
+# parsing are shared with the streaming code in utils.
+import asyncio
+import time
+from functools import partial
+from itertools import islice
+from typing import Callable, Iterable, List, Optional, Tuple
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.db import connections
+from . import scoreboard
+from .catalog import get_free_models
+from .dedupe import DuplicateIndex
+from .http import loop_state
+from .metrics import timed
+from .ratelimit import (RateLimitExceeded, aacquire, arequest_with_backoff,
+                        backoff_delay)
+from .summary_cache import summary_cache
+from .utils import (BART_ERROR, BART_TIMEOUT, CARD_MAX_WORKERS,
+                    EXTRACTIVE_CHUNK_WORDS, EXTRACTIVE_FALLBACK,
+                    GENERATION_MODE, HEDGE_DELAY, HEDGE_FAN_OUT,
+                    HUGGINGFACE_API_TOKEN, HUGGINGFACE_API_URL, MAX_CHUNKS,
+                    MAP_REDUCE_FAN_OUT, MAP_REDUCE_MAX_CHUNKS,
+                    MAP_REDUCE_MAX_DEPTH, OPENROUTER_CHAT_URL, OR_API,
+                    SUMMARY_LATENCY_BUDGET, SUMMARY_MAP_REDUCE,
+                    SUMMARY_MAX_WORKERS, SUMMARY_MODE, build_card_prompt,
+                    card_request_body, completion_content, extractive_summary,
+                    fits_one_window, headers, iter_chunks, local_flashcards,
+                    openrouter_headers, parse_cards, plan_generation,
+                    top_up_local_cards)
+
+UPSTREAM_ERRORS = (httpx.HTTPError, requests.RequestException, ValueError,
+                   KeyError, IndexError, TypeError)
+
+# Cache lookups and CPU-bound work that must stay off the event loop but
+# need no particular thread
+offload = partial(sync_to_async, thread_sensitive=False)
+
+# Late cache writes, kept referenced until they finish
+_background = set()
+
+
+def _limit(name: str, size: int) -> asyncio.Semaphore:
+    """Concurrency limit shared by every caller on the running loop
+
+    Takes the place of the per-process thread pools: under ASGI each worker
+    process runs a single loop.
+    """
+    state = loop_state()
+    if name not in state:
+        state[name] = asyncio.Semaphore(size)
+    return state[name]
+
+
+@timed('call_bart_api')
+async def acall_bart_api(text, timeout=BART_TIMEOUT):
+    try:
+        response = await arequest_with_backoff(
+            'huggingface', HUGGINGFACE_API_TOKEN, 'POST', HUGGINGFACE_API_URL,
+            headers=headers, json={"inputs": text}, timeout=timeout)
+        if response.status_code == 200:
+            return response.json()[0]['summary_text']
+    except UPSTREAM_ERRORS:
+        pass
+    return BART_ERROR
+
+
+def _cached_summaries(chunks):
+    return [summary_cache.get(chunk, HUGGINGFACE_API_URL) for chunk in chunks]
+
+
+def _store_summaries(summaries):
+    for chunk, summary in summaries:
+        summary_cache.set(chunk, HUGGINGFACE_API_URL, summary)
+
+
+def _store_late_summary(chunk, summary):
+    # Runs on a shared worker thread that Django never closes connections
+    # for, which matters when the summary cache is database backed
+    try:
+        summary_cache.set(chunk, HUGGINGFACE_API_URL, summary)
+    finally:
+        connections.close_all()
+
+
+def _cache_late_summary(chunk, task):
+    if task.cancelled() or task.exception() is not None or \
+            task.result() == BART_ERROR:
+        return
+    store = asyncio.ensure_future(
+        offload(_store_late_summary)(chunk, task.result()))
+    _background.add(store)
+    store.add_done_callback(_background.discard)
+
+
+async def asummarize_chunks(chunks, budget=SUMMARY_LATENCY_BUDGET,
+                            fallback=EXTRACTIVE_FALLBACK):
+    """Summarize chunks concurrently, keeping only the successful summaries
+
+    With fallback on, a chunk BART fails on or has not finished within
+    budget seconds gets a local extractive summary instead. Chunks still
+    waiting for one of the SUMMARY_MAX_WORKERS slots at the deadline are
+    cancelled; an answer already in flight is cached if its loop outlives
+    the request, as the ASGI server's does.
+    """
+    # The cache may be database backed, so it is read in one sync hop
+    summaries = await sync_to_async(_cached_summaries)(chunks)
+    limit = _limit('bart', SUMMARY_MAX_WORKERS)
+    sent = set()
+
+    async def summarize(i):
+        async with limit:
+            sent.add(i)
+            return await acall_bart_api(chunks[i])
+
+    tasks = {i: asyncio.ensure_future(summarize(i))
+             for i in range(len(chunks)) if summaries[i] is None}
+    if tasks:
+        await asyncio.wait(tasks.values(), timeout=budget or None)
+
+    fresh = []
+    for i, task in tasks.items():
+        if task.done():
+            summaries[i] = task.result()
+            if summaries[i] != BART_ERROR:
+                fresh.append((chunks[i], summaries[i]))
+            continue
+
+        if i in sent:
+            task.add_done_callback(partial(_cache_late_summary, chunks[i]))
+        else:
+            task.cancel()
+        summaries[i] = BART_ERROR
+
+    if fresh:
+        await sync_to_async(_store_summaries)(fresh)
+
+    failed = [i for i, summary in enumerate(summaries)
+              if summary == BART_ERROR]
+    if fallback and failed:
+        extracts = await offload(lambda: [
+            extractive_summary(chunks[i], EXTRACTIVE_CHUNK_WORDS)
+            for i in failed])()
+        for i, extract in zip(failed, extracts):
+            summaries[i] = extract
+
+    return [summary for summary in summaries if summary != BART_ERROR]
+
+
+async def amap_reduce_summarize(text, max_depth=MAP_REDUCE_MAX_DEPTH,
+                                fan_out=MAP_REDUCE_FAN_OUT,
+                                budget=SUMMARY_LATENCY_BUDGET):
+    """Summarize every chunk, then summarize groups of partial summaries
+
+    Each round merges up to fan_out partial summaries into one BART input,
+    so the number of sequential rounds grows with log(chunks). Stops once
+    the combined summary fits a single window, max_depth is reached or the
+    latency budget, shared by every round, runs out.
+    """
+    deadline = time.monotonic() + budget if budget else None
+    chunks = list(islice(iter_chunks(text), MAP_REDUCE_MAX_CHUNKS))
+    partials = await asummarize_chunks(chunks, budget)
+    if not partials:
+        return BART_ERROR
+
+    for _ in range(max_depth - 1):
+        if fits_one_window("\n\n".join(partials)):
+            break
+        remaining = deadline and deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            break
+
+        groups = [' '.join(partials[i:i + fan_out])
+                  for i in range(0, len(partials), fan_out)]
+        reduced = await asummarize_chunks(
+            [chunk for group in groups for chunk in iter_chunks(group)],
+            remaining)
+        if not reduced:
+            break
+        partials = reduced
+
+    return "\n\n".join(partials)
+
+
+@timed('summarize_text')
+async def asummarize_text(text, map_reduce=SUMMARY_MAP_REDUCE,
+                          mode=SUMMARY_MODE):
+    if mode == "fast":
+        return await offload(extractive_summary)(text)
+
+    chunks = list(islice(iter_chunks(text), MAX_CHUNKS + 1))
+    if not chunks:
+        return ""
+
+    # Documents longer than MAX_CHUNKS are reduced instead of truncated
+    if map_reduce and len(chunks) > MAX_CHUNKS:
+        return await amap_reduce_summarize(text)
+
+    # Keep whatever succeeded, only report an error if every chunk failed
+    successful = await asummarize_chunks(chunks[:MAX_CHUNKS])
+    if not successful:
+        return BART_ERROR
+
+    return "\n\n".join(successful)
+
+
+async def arequest_cards(model: str, prompt: str, number: int) -> Optional[
+    List[Tuple[str, str]]]:
+    """Ask a single model for cards, None if it fails or nothing parses
+
+    May return fewer than `number` cards when the model slipped up partway.
+    Our own rate limit turning the call away says nothing about the model,
+    so it is not recorded on the scoreboard.
+    """
+    async with _limit('openrouter', CARD_MAX_WORKERS):
+        try:
+            await aacquire('openrouter', OR_API)
+        except RateLimitExceeded:
+            return None
+
+        # The clock starts once the token is taken, waiting for it is not
+        # latency
+        started = time.monotonic()
+        try:
+            response = await arequest_with_backoff(
+                'openrouter', OR_API, 'POST', OPENROUTER_CHAT_URL,
+                acquired=True, headers=openrouter_headers(),
+                json=card_request_body(model, prompt), timeout=45)
+            response.raise_for_status()
+            content = completion_content(response.json())
+        except RateLimitExceeded:
+            return None
+        except UPSTREAM_ERRORS:
+            content = None
+
+    if content is None:
+        cards, outcome = None, scoreboard.ERROR
+    else:
+        cards, outcome = parse_cards(content, number)
+    await offload(scoreboard.record)(model, outcome,
+                                     time.monotonic() - started)
+    return cards
+
+
+@timed('create_cards')
+async def acreate_cards(text: str, number: int, models: List[str],
+                        existing_questions: List[str],
+                        hedge_delay: Optional[float] = HEDGE_DELAY,
+                        fan_out: int = HEDGE_FAN_OUT) -> Optional[
+    List[Tuple[str, str]]]:
+    """Try to create cards using available models, avoiding duplicate questions
+
+    Starts fan_out models at once. Whenever hedge_delay seconds pass without
+    an answer another model joins the race, and failed models are replaced
+    straight away. The first response with any valid pairs wins; a short
+    one is returned as is and the caller asks again for the rest. Losing
+    requests are cancelled and their connections go back to the pool.
+    """
+    prompt = build_card_prompt(text, number, existing_questions)
+    models = await offload(scoreboard.rank_models)(list(models))
+    in_flight = set()
+    next_model = 0
+
+    def launch():
+        nonlocal next_model
+        in_flight.add(asyncio.ensure_future(
+            arequest_cards(models[next_model], prompt, number)))
+        next_model += 1
+
+    try:
+        while next_model < len(models) and len(in_flight) < max(fan_out, 1):
+            launch()
+
+        while in_flight:
+            done, in_flight = await asyncio.wait(
+                in_flight, timeout=hedge_delay,
+                return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                cards = task.result()
+                if cards:
+                    return cards
+
+            # Nothing came back in time, hedge with one more model
+            if not done and next_model < len(models):
+                launch()
+            while next_model < len(models) and len(in_flight) < fan_out:
+                launch()
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+    return None
+
+
+@timed('generate_flashcards')
+async def agenerate_flashcards(text: str, number: int,
+                               on_progress: Optional[
+                                   Callable[[float], None]] = None,
+                               known_questions: Iterable[str] = (),
+                               mode: str = GENERATION_MODE
+                               ) -> Optional[List[Tuple[str, str]]]:
+    """Generate flashcards with automatic model switching and duplicate prevention
+
+    Cards whose question nearly duplicates one generated earlier in the
+    session or one in known_questions are dropped locally. "instant" mode
+    builds cloze cards locally instead, and with LOCAL_CARD_FALLBACK on,
+    local cards also make up whatever the models could not deliver.
+    on_progress is a sync callable, run in the caller's thread.
+    """
+    if not (0 < number < 7):
+        return None
+
+    known_questions = list(known_questions)
+    if mode == "instant":
+        return await offload(local_flashcards)(
+            text, number, known_questions) or None
+
+    report = sync_to_async(on_progress) if on_progress else None
+    available_models = await sync_to_async(get_free_models)()
+    if not available_models:
+        return await offload(top_up_local_cards)([], text, number,
+                                                 known_questions)
+
+    duplicates = DuplicateIndex(known_questions)
+
+    # First round: every part of the text asks for its share at once
+    results = await asyncio.gather(*(
+        acreate_cards(part, count, available_models, [])
+        for part, count in plan_generation(text, number)))
+    cards = []
+    for result in results:
+        cards.extend(duplicates.filter_new(result or []))
+    cards = cards[:number]
+    if report and cards:
+        await report(len(cards) / number)
+
+    # Top up whatever is still missing against the whole text
+    existing_questions = [question for question, _ in cards]
+    remaining = number - len(cards)
+    max_attempts = 3
+
+    if remaining == 0:
+        return cards
+
+    for attempt in range(max_attempts):
+        while remaining > 0:
+            num_to_generate = remaining // 2 if remaining > 3 else remaining
+
+            new_cards = await acreate_cards(text, num_to_generate,
+                                            available_models,
+                                            existing_questions)
+            new_cards = duplicates.filter_new(new_cards or [])
+
+            if new_cards:
+                existing_questions.extend(question
+                                          for question, _ in new_cards)
+                cards.extend(new_cards)
+                remaining -= len(new_cards)
+                if report:
+                    await report(len(cards) / number)
+            else:
+                break
+
+        if remaining == 0:
+            return cards
+        else:
+            available_models = await sync_to_async(get_free_models)()
+            await asyncio.sleep(backoff_delay(attempt))
+
+    return await offload(top_up_local_cards)(cards, text, number,
+                                             known_questions)
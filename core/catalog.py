@@ -0,0 +1,118 @@
+import threading
+import time
+from typing import List, Optional
+from decouple import config
+from django.core.cache import cache
+from django.db import connections
+from .metrics import timed
+from .ratelimit import request_with_backoff
+
+OPENROUTER_MODELS_URL = config("OPENROUTER_MODELS_URL",
+                               default="https://openrouter.ai/api/v1/models")
+
+# Serve the cached list for CATALOG_TTL seconds, then keep serving it while a
+# background refresh runs, for at most CATALOG_MAX_STALE seconds in total.
+CATALOG_TTL = config("MODEL_CATALOG_TTL", default=600, cast=int)
+CATALOG_MAX_STALE = config("MODEL_CATALOG_MAX_STALE", default=86400, cast=int)
+# After a failed cold fetch the fallback list is served this long before
+# the catalog is tried again
+CATALOG_RETRY = config("MODEL_CATALOG_RETRY", default=60, cast=int)
+
+CATALOG_CACHE_KEY = "openrouter:free_models"
+CATALOG_LOCK_KEY = "openrouter:free_models:refreshing"
+CATALOG_LOCK_TIMEOUT = 30
+
+FALLBACK_MODELS = [
+    "meta-llama/llama-3.2-1b-instruct:free",
+    "meta-llama/llama-3.2-3b-instruct:free",
+    "microsoft/phi-3-mini-128k-instruct:free",
+    "google/gemma-2-9b-it:free",
+    "qwen/qwen-2-7b-instruct:free"
+]
+
+
+def fetch_free_models() -> List[str]:
+    """Download the OpenRouter catalog and keep only the free models"""
+    response = request_with_backoff('openrouter', '', 'GET',
+                                    OPENROUTER_MODELS_URL, timeout=10)
+    response.raise_for_status()
+    models_data = response.json()
+
+    # Filter for free models (pricing.prompt = 0 and pricing.completion = 0)
+    free_models = []
+    for model in models_data.get('data', []):
+        pricing = model.get('pricing', {})
+        if (pricing.get('prompt') == '0' or pricing.get('prompt') == 0) and \
+                (pricing.get('completion') == '0' or pricing.get(
+                    'completion') == 0):
+            free_models.append(model['id'])
+
+    return free_models
+
+
+def refresh_catalog() -> Optional[List[str]]:
+    """Fetch the catalog and store it in the shared cache"""
+    try:
+        free_models = fetch_free_models()
+    except Exception:
+        return None
+
+    if not free_models:
+        return None
+
+    cache.set(CATALOG_CACHE_KEY,
+              {"models": free_models, "fetched_at": time.time()},
+              CATALOG_MAX_STALE)
+    return free_models
+
+
+def _refresh_worker():
+    try:
+        refresh_catalog()
+    finally:
+        cache.delete(CATALOG_LOCK_KEY)
+        connections.close_all()
+
+
+def refresh_in_background() -> bool:
+    """Start a refresh unless another thread or worker is already doing one"""
+    if not cache.add(CATALOG_LOCK_KEY, True, CATALOG_LOCK_TIMEOUT):
+        return False
+    threading.Thread(target=_refresh_worker, name="model-catalog",
+                     daemon=True).start()
+    return True
+
+
+@timed('get_free_models')
+def get_free_models() -> List[str]:
+    """Return the free models, refreshing the cached catalog when stale"""
+    entry = cache.get(CATALOG_CACHE_KEY)
+
+    if entry is None:
+        # Cold cache: one caller downloads, the others use the fallback list
+        # instead of piling onto the same request
+        if not cache.add(CATALOG_LOCK_KEY, True, CATALOG_LOCK_TIMEOUT):
+            return list(FALLBACK_MODELS)
+        try:
+            free_models = refresh_catalog()
+            if free_models is None:
+                # Don't make every call wait on an unreachable catalog
+                cache.set(CATALOG_CACHE_KEY, {
+                    "models": FALLBACK_MODELS, "fetched_at": time.time(),
+                    "fallback": True}, CATALOG_RETRY)
+        finally:
+            cache.delete(CATALOG_LOCK_KEY)
+        return free_models or list(FALLBACK_MODELS)
+
+    if time.time() - entry["fetched_at"] > CATALOG_TTL:
+        refresh_in_background()
+
+    return list(entry["models"])
+
+
+def catalog_age() -> Optional[float]:
+    """Seconds since the catalog was last refreshed, None if never"""
+    entry = cache.get(CATALOG_CACHE_KEY)
+    if entry is None or entry.get("fallback"):
+        return None
+    return time.time() - entry["fetched_at"]
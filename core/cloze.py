@@ -0,0 +1,148 @@
+import re
+from typing import Iterable, List, Tuple
+import numpy as np
+from .dedupe import STOPWORDS, DuplicateIndex
+from .extractive import TOKEN, term_salience, textrank
+
+# Words that never start, end or make up the blanked phrase
+FUNCTION_WORDS = STOPWORDS | frozenset("""
+about after all also although among any because been before being between
+both but could during each either every had has have he her his however i
+into many may might more most much must neither no nor not now often only
+other our over same she should since so some such than that their them then
+there these they those through thus under until upon us very we while will
+would you your
+""".split())
+PHRASE_OPENERS = frozenset(
+    "the a an of in on into from by with for as its their his her".split())
+PRONOUN_SUBJECTS = frozenset("it this that these those they he she we".split())
+
+DEFINITION = re.compile(
+    r"^(?P<term>(?:(?:the|a|an) )?[\w'-]+(?: [\w'-]+){0,4}?) "
+    r"(?P<verb>is|are|refers to|means|is defined as|is called) "
+    r"(?P<definition>.{12,})$", re.IGNORECASE)
+MIN_SENTENCE_WORDS = 6
+MAX_SENTENCE_WORDS = 45
+MAX_PHRASE_WORDS = 3
+BLANK = "_____"
+
+
+def _definition_card(sentence):
+    """(question, answer, term) for "X is Y" sentences, else None"""
+    match = DEFINITION.match(sentence.rstrip('.!?'))
+    if not match:
+        return None
+    term = match.group('term')
+    words = term.lower().split()
+    if words[0] in PRONOUN_SUBJECTS or all(word in FUNCTION_WORDS
+                                           for word in words):
+        return None
+    if words[0] in ('the', 'a', 'an'):
+        term = term[0].lower() + term[1:]
+
+    wh = "What are" if match.group('verb').lower() == "are" else "What is"
+    definition = match.group('definition').strip()
+    return (f"{wh} {term}?", definition[0].upper() + definition[1:] + ".",
+            term)
+
+
+def _phrases(tokens):
+    """Candidate (start, stop) spans that look like noun phrases
+
+    Without a tagger: runs of capitalised words inside the sentence (names),
+    runs of content words opened by a determiner or preposition and closed
+    by a function word, and any single content word.
+    """
+    for i, token in enumerate(tokens):
+        if token.lower() in FUNCTION_WORDS:
+            continue
+        yield i, i + 1
+
+        opener = i == 0 or tokens[i - 1].lower() in PHRASE_OPENERS
+        if opener and (i == 0 or not tokens[i - 1][:1].isupper()):
+            stop = i
+            while stop < len(tokens) and \
+                    tokens[stop].lower() not in FUNCTION_WORDS:
+                stop += 1
+            if 1 < stop - i <= MAX_PHRASE_WORDS:
+                yield i, stop
+
+        previous_capital = i and tokens[i - 1][:1].isupper() and \
+            tokens[i - 1].lower() not in FUNCTION_WORDS
+        if token[:1].isupper() and not previous_capital:
+            stop = i
+            while stop < len(tokens) and tokens[stop][:1].isupper():
+                stop += 1
+            if 1 < stop - i <= MAX_PHRASE_WORDS:
+                yield i, stop
+
+
+def _best_phrase(tokens, salience):
+    """The candidate phrase with the highest mean TF-IDF weight
+
+    Longer phrases get only a slight bonus, so a verb swept into a run
+    drags its mean below the noun on its own. Names get a larger one.
+    """
+    best, best_score = None, 0.0
+    for start, stop in _phrases(tokens):
+        phrase = tokens[start:stop]
+        score = sum(salience.get(token.lower(), 0.0) for token in phrase) \
+            / len(phrase) * (1 + 0.05 * (len(phrase) - 1))
+        if all(token[:1].isupper() for token in phrase) and (
+                start or len(phrase) > 1):
+            score *= 1.3
+        if score > best_score:
+            best, best_score = (start, stop), score
+    return best
+
+
+def _cloze_card(sentence, salience):
+    """(question, answer, answer) with the key phrase blanked out"""
+    tokens = TOKEN.findall(sentence)
+    span = _best_phrase(tokens, salience)
+    if span is None:
+        return None
+    answer = ' '.join(tokens[span[0]:span[1]])
+    pattern = r'\b' + r'\W+'.join(map(re.escape, tokens[span[0]:span[1]])) \
+        + r'\b'
+    question, blanked = re.subn(pattern, BLANK, sentence, count=1)
+    if not blanked:
+        return None
+    return f"Fill in the blank: {question}", answer, answer
+
+
+def make_cards(sentences: List[str], number: int,
+               known_questions: Iterable[str] = ()) -> List[Tuple[str, str]]:
+    """Definition and cloze cards from the highest ranked sentences
+
+    Sentences are ranked with TextRank and the blanked phrase is the one
+    with the most TF-IDF weight. Cards come back in document order.
+    """
+    candidates = [i for i, sentence in enumerate(sentences)
+                  if MIN_SENTENCE_WORDS <= len(sentence.split())
+                  <= MAX_SENTENCE_WORDS]
+    if not candidates or number <= 0:
+        return []
+
+    chosen = [sentences[i] for i in candidates]
+    scores = textrank(chosen)
+    salience = term_salience(chosen)
+    duplicates = DuplicateIndex(known_questions)
+
+    cards = []
+    for index in np.argsort(-scores, kind='stable'):
+        sentence = chosen[index]
+        card = _definition_card(sentence) or _cloze_card(sentence, salience)
+        if card is None:
+            continue
+        question, answer, focus = card
+        if duplicates.add_if_new(question):
+            cards.append((index, (question, answer)))
+            if len(cards) >= number:
+                break
+            # Spread the cards over different terms
+            for token in TOKEN.findall(focus.lower()):
+                if token in salience:
+                    salience[token] *= 0.3
+
+    return [card for _, card in sorted(cards)]
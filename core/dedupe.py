@@ -0,0 +1,91 @@
+import re
+from collections import Counter, defaultdict
+from typing import Iterable, List, Tuple
+from decouple import config
+
+# Questions whose content words overlap at least this much (Jaccard) are
+# treated as the same question.
+DEDUPE_THRESHOLD = config("DEDUPE_THRESHOLD", default=0.7, cast=float)
+# How many of the user's saved questions are loaded to check against
+DEDUPE_SAVED_LIMIT = config("DEDUPE_SAVED_LIMIT", default=5000, cast=int)
+
+STOPWORDS = frozenset("""
+a an and are as at be by can define describe did do does explain for from
+how in is it its name of on or state the this to was were what when where
+which who whom whose why with
+""".split())
+
+
+def normalize(text: str) -> frozenset:
+    """Lower-cased content words with a light plural strip"""
+    tokens = set()
+    for token in re.findall(r'\w+', text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.add(token)
+    return frozenset(tokens)
+
+
+class DuplicateIndex:
+    """Near-duplicate lookup over questions via an inverted token index
+
+    Only questions sharing at least one content word are compared, so a
+    lookup costs time proportional to the overlapping postings rather than
+    to the whole library.
+    """
+
+    def __init__(self, questions: Iterable[str] = (),
+                 threshold: float = DEDUPE_THRESHOLD):
+        self.threshold = threshold
+        self._token_sets = []
+        self._postings = defaultdict(list)
+        self._exact = set()
+        for question in questions:
+            self.add(question)
+
+    def add(self, question: str):
+        tokens = normalize(question)
+        self._exact.add(tokens)
+        index = len(self._token_sets)
+        self._token_sets.append(tokens)
+        for token in tokens:
+            self._postings[token].append(index)
+
+    def is_duplicate(self, question: str) -> bool:
+        tokens = normalize(question)
+        if tokens in self._exact:
+            return True
+        if not tokens:
+            return False
+
+        overlaps = Counter()
+        for token in tokens:
+            overlaps.update(self._postings.get(token, ()))
+
+        for index, shared in overlaps.items():
+            union = len(tokens) + len(self._token_sets[index]) - shared
+            if shared / union >= self.threshold:
+                return True
+        return False
+
+    def add_if_new(self, question: str) -> bool:
+        """Add the question unless it duplicates one already indexed"""
+        if self.is_duplicate(question):
+            return False
+        self.add(question)
+        return True
+
+    def filter_new(self, cards: List[Tuple[str, str]]
+                   ) -> List[Tuple[str, str]]:
+        return [card for card in cards if self.add_if_new(card[0])]
+
+
+def saved_questions(user) -> List[str]:
+    """The user's most recently saved questions"""
+    from .models import Flashcard
+
+    return list(Flashcard.objects.filter(
+        flashcard_set__user=user).order_by('-id').values_list(
+        'question', flat=True)[:DEDUPE_SAVED_LIMIT])
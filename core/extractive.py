@@ -0,0 +1,116 @@
+import re
+from typing import Dict, List
+import numpy as np
+from .dedupe import STOPWORDS
+
+TOKEN = re.compile(r'\w+')
+# TextRank damping and stopping rule
+DAMPING = 0.85
+MAX_ITERATIONS = 50
+TOLERANCE = 1e-6
+
+
+def _term_matrix(sentences: List[str]):
+    """Sparse TF-IDF rows as CSR-style (row ids, term ids, weights)"""
+    vocabulary = {}
+    rows, terms = [], []
+    for row, sentence in enumerate(sentences):
+        for token in TOKEN.findall(sentence.lower()):
+            if token not in STOPWORDS:
+                rows.append(row)
+                terms.append(vocabulary.setdefault(token, len(vocabulary)))
+    if not rows:
+        return None
+
+    # Sorting the combined (row, term) key merges repeated terms within a
+    # sentence into one entry holding its count, ordered by row
+    n_terms = len(vocabulary)
+    keys, tf = np.unique(np.asarray(rows, dtype=np.int64) * n_terms +
+                         np.asarray(terms, dtype=np.int64),
+                         return_counts=True)
+    rows, terms = np.divmod(keys, n_terms)
+
+    df = np.bincount(terms, minlength=n_terms)
+    idf = np.log((1 + len(sentences)) / (1 + df)) + 1
+    weights = (1 + np.log(tf)) * idf[terms]
+
+    norms = np.sqrt(np.bincount(rows, weights=weights ** 2,
+                                minlength=len(sentences)))
+    weights /= norms[rows]
+    return rows, terms, weights, list(vocabulary)
+
+
+def term_salience(sentences: List[str]) -> Dict[str, float]:
+    """Each term's summed TF-IDF weight across the document"""
+    matrix = _term_matrix(sentences)
+    if matrix is None:
+        return {}
+    _, terms, weights, vocabulary = matrix
+    totals = np.bincount(terms, weights=weights, minlength=len(vocabulary))
+    return dict(zip(vocabulary, totals.tolist()))
+
+
+def textrank(sentences: List[str]) -> np.ndarray:
+    """TextRank score per sentence over cosine similarity of TF-IDF rows
+
+    The similarity matrix S = X X^T is never built. Each power iteration
+    multiplies through X^T and X with bincount, so a step costs O(nnz)
+    instead of O(sentences^2).
+    """
+    n = len(sentences)
+    matrix = _term_matrix(sentences)
+    if matrix is None or n < 3:
+        return np.ones(n)
+    rows, terms, weights, vocabulary = matrix
+    n_terms = len(vocabulary)
+
+    def similarity(vector):
+        # S v without the diagonal, which is 1 for every non-empty row
+        projected = np.bincount(terms, weights=weights * vector[rows],
+                                minlength=n_terms)
+        product = np.bincount(rows, weights=weights * projected[terms],
+                              minlength=n)
+        nonempty = np.bincount(rows, minlength=n) > 0
+        return product - vector * nonempty
+
+    degree = similarity(np.ones(n))
+    connected = degree > 1e-12
+    inverse_degree = np.divide(1.0, degree, out=np.zeros(n),
+                               where=connected)
+
+    scores = np.full(n, 1.0 / n)
+    for _ in range(MAX_ITERATIONS):
+        updated = (1 - DAMPING) / n + DAMPING * similarity(
+            scores * inverse_degree)
+        if np.abs(updated - scores).sum() < TOLERANCE:
+            scores = updated
+            break
+        scores = updated
+    return scores
+
+
+def summarize_sentences(sentences: List[str], max_words: int) -> str:
+    """The highest ranked sentences, in document order, within max_words"""
+    if not sentences:
+        return ""
+
+    scores = textrank(sentences)
+    lengths = np.fromiter((len(sentence.split()) for sentence in sentences),
+                          dtype=np.int64, count=len(sentences))
+    # Sentences sharing no terms with the rest only get the teleport score
+    isolated = scores <= (1 - DAMPING) / len(sentences) + 1e-12
+    chosen = []
+    budget = max_words
+    for index in np.argsort(-scores, kind='stable'):
+        if isolated[index] and chosen:
+            break
+        if lengths[index] <= budget:
+            chosen.append(index)
+            budget -= lengths[index]
+        if budget <= 0:
+            break
+    if not chosen:
+        # Every sentence is over budget; clip the best one instead
+        return ' '.join(sentences[int(np.argmax(scores))].split()[:max_words])
+
+    return ' '.join(sentences[index] for index in sorted(chosen))
@@ -0,0 +1,42 @@
+import json
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+
+def validate_flashcards(flashcards):
+    """Check a decoded list of [question, answer] pairs and normalise it"""
+    if not isinstance(flashcards, list) or not flashcards:
+        raise ValidationError("Flashcards must be a non-empty list.")
+    if len(flashcards) > settings.MAX_CARDS_PER_SET:
+        raise ValidationError(
+            f"A set can hold at most {settings.MAX_CARDS_PER_SET} cards.")
+
+    cleaned = []
+    for card in flashcards:
+        if not isinstance(card, (list, tuple)) or len(card) != 2:
+            raise ValidationError(
+                "Each flashcard must be a [question, answer] pair.")
+        question, answer = card
+        if not isinstance(question, str) or not isinstance(answer, str):
+            raise ValidationError("Questions and answers must be text.")
+        question, answer = question.strip(), answer.strip()
+        if not question or not answer:
+            raise ValidationError("Questions and answers cannot be empty.")
+        cleaned.append((question, answer))
+    return cleaned
+
+
+class FlashcardSetForm(forms.Form):
+    set_title = forms.CharField(max_length=200, required=False)
+    flashcards_data = forms.CharField()
+
+    def clean_set_title(self):
+        return self.cleaned_data.get('set_title') or 'Untitled Set'
+
+    def clean_flashcards_data(self):
+        try:
+            flashcards = json.loads(self.cleaned_data['flashcards_data'])
+        except json.JSONDecodeError:
+            raise ValidationError("Flashcards data is not valid JSON.")
+        return validate_flashcards(flashcards)
@@ -0,0 +1,56 @@
+import asyncio
+import httpx
+import requests
+from decouple import config
+from requests.adapters import HTTPAdapter
+
+HTTP_POOL_SIZE = config("HTTP_POOL_SIZE", default=10, cast=int)
+# An ASGI worker multiplexes many requests, so its pool can be much larger
+ASYNC_HTTP_POOL_SIZE = config("ASYNC_HTTP_POOL_SIZE", default=200, cast=int)
+
+# One keep-alive session per process so repeated calls to Hugging Face and
+# OpenRouter reuse their TLS connections instead of handshaking every time.
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                                      pool_maxsize=HTTP_POOL_SIZE))
+
+_loop_state = {}
+
+
+def loop_state() -> dict:
+    """Storage for the running event loop, dropped when the loop shuts down
+
+    asyncio.run, which async_to_sync uses for its short-lived loops, cancels
+    the tasks left over before closing the loop. A task waiting for that
+    cancellation closes the loop's client and forgets the rest.
+    """
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+    if state is None:
+        state = _loop_state[loop] = {}
+        state["closer"] = loop.create_task(_close_on_shutdown(loop))
+    return state
+
+
+async def _close_on_shutdown(loop):
+    try:
+        await asyncio.Event().wait()
+    finally:
+        client = _loop_state.pop(loop).get("client")
+        if client is not None:
+            await client.aclose()
+
+
+def async_session() -> httpx.AsyncClient:
+    """The pooled async client for the running event loop
+
+    httpx clients are tied to the loop they were first used on. Under ASGI
+    that is the server's single loop; sync code calling in through
+    async_to_sync gets a client for its own short-lived loop.
+    """
+    state = loop_state()
+    if "client" not in state:
+        state["client"] = httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=ASYNC_HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_POOL_SIZE))
+    return state["client"]
@@ -0,0 +1,112 @@
+import asyncio
+import traceback
+from datetime import timedelta
+from typing import Optional
+from asgiref.sync import async_to_sync, sync_to_async
+from decouple import config
+from django.db import connection, transaction
+from django.utils import timezone
+from .async_utils import agenerate_flashcards, asummarize_text
+from .dedupe import saved_questions
+from .models import Job
+
+# Running jobs that have not finished after this long are assumed to belong
+# to a worker that died and are handed out again.
+JOB_STALE_AFTER = config("JOB_STALE_AFTER", default=900, cast=int)
+# A job still running after this long is cancelled and marked failed. Kept
+# below JOB_STALE_AFTER so a live worker never holds a job that
+# requeue_stale has already handed to another.
+JOB_TIMEOUT = config("JOB_TIMEOUT", default=600, cast=int)
+# Jobs one worker runs at once, each mostly waiting on upstream APIs
+JOB_CONCURRENCY = config("JOB_CONCURRENCY", default=4, cast=int)
+
+
+async def _summarize(job):
+    return {"summary": await asummarize_text(job.payload.get("text", ""))}
+
+
+async def _generate_flashcards(job):
+    def on_progress(fraction):
+        set_progress(job, fraction)
+
+    known_questions = await sync_to_async(saved_questions)(job.user_id)
+    flashcards = await agenerate_flashcards(job.payload.get("text", ""),
+                                            job.payload.get("num_cards", 3),
+                                            on_progress=on_progress,
+                                            known_questions=known_questions)
+    return {"flashcards": flashcards}
+
+
+HANDLERS = {
+    Job.SUMMARIZE: _summarize,
+    Job.GENERATE_FLASHCARDS: _generate_flashcards,
+}
+
+
+def enqueue(user, kind, **payload) -> Job:
+    """Record a job for the worker and return it immediately"""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    return Job.objects.create(user=user, kind=kind, payload=payload)
+
+
+def claim_next() -> Optional[Job]:
+    """Atomically take the oldest pending job, or None if there is none"""
+    with transaction.atomic():
+        pending = Job.objects.filter(status=Job.PENDING).order_by('created_at')
+        if connection.features.has_select_for_update_skip_locked:
+            pending = pending.select_for_update(skip_locked=True)
+        job = pending.first()
+        if job is None:
+            return None
+
+        job.status = Job.RUNNING
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+    return job
+
+
+def set_progress(job, fraction):
+    job.progress = max(0, min(100, int(fraction * 100)))
+    Job.objects.filter(pk=job.pk).update(progress=job.progress)
+
+
+async def arun_job(job):
+    """Execute a claimed job and store its result or error"""
+    try:
+        job.result = await asyncio.wait_for(HANDLERS[job.kind](job),
+                                            JOB_TIMEOUT)
+        job.status = Job.SUCCEEDED
+        job.progress = 100
+    except Exception:
+        job.status = Job.FAILED
+        job.error = traceback.format_exc(limit=5)
+    job.finished_at = timezone.now()
+    await sync_to_async(job.save)(update_fields=[
+        'result', 'status', 'progress', 'error', 'finished_at'])
+    return job
+
+
+def run_job(job):
+    return async_to_sync(arun_job)(job)
+
+
+def requeue_stale() -> int:
+    cutoff = timezone.now() - timedelta(seconds=JOB_STALE_AFTER)
+    return Job.objects.filter(status=Job.RUNNING,
+                              started_at__lt=cutoff).update(
+        status=Job.PENDING, started_at=None, progress=0)
+
+
+def job_to_dict(job) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress,
+        "result": job.result,
+        "error": "Job failed." if job.status == Job.FAILED else "",
+        "created_at": job.created_at.isoformat(),
+        "finished_at": job.finished_at.isoformat() if job.finished_at
+        else None,
+    }
@@ -0,0 +1,193 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import (CaptureQueriesContext, setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+from core.catalog import refresh_catalog
+from core.jobs import claim_next, enqueue, run_job
+from core.scoreboard import percentile
+from core.stubs import StubUpstream, use_stub
+from core.utils import (CardStreamParser, chunk_text, generate_flashcards,
+                        iter_chunks, parse_cards, summarize_text)
+from .benchmark_chunker import make_text
+
+SAMPLE_CARDS = "\n".join(f"|What is fact number {i} in the text? $$ "
+                         f"It is the answer to fact {i}.|" for i in range(6))
+
+
+class Command(BaseCommand):
+    help = ("Microbenchmarks plus end-to-end runs against local stand-ins "
+            "for Hugging Face and OpenRouter, on a throwaway test database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=['micro', 'e2e'])
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--words', type=int, default=20000,
+                            help="Document size for the chunking benchmarks")
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help="Parallel generations in the upstream run")
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help="Stub upstream latency in seconds")
+        parser.add_argument('--jitter', type=float, default=0.05)
+        parser.add_argument('--error-rate', type=float, default=0.05)
+        parser.add_argument('--malformed-rate', type=float, default=0.1)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['only'] != 'e2e':
+            self.micro(options)
+        if options['only'] != 'micro':
+            self.end_to_end(options)
+
+    def report(self, name, timings, queries=None):
+        total = sum(timings)
+        line = (f"{name:<34} p50 {percentile(timings, 0.5) * 1000:9.2f} ms  "
+                f"p95 {percentile(timings, 0.95) * 1000:9.2f} ms  "
+                f"{len(timings) / total if total else 0:9.1f} /s")
+        if queries is not None:
+            line += f"  {max(queries):3d} queries max"
+        self.stdout.write(line)
+
+    def time_calls(self, func, iterations):
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    def micro(self, options):
+        iterations = options['iterations']
+        text = make_text(options['words'], options['seed'])
+        self.stdout.write(f"Microbenchmarks, {options['words']} words, "
+                          f"{iterations} iterations")
+
+        def stream_parse():
+            parser = CardStreamParser()
+            for start in range(0, len(SAMPLE_CARDS), 16):
+                parser.feed(SAMPLE_CARDS[start:start + 16])
+
+        cases = [
+            ("chunk_text", lambda: chunk_text(text)),
+            ("iter_chunks (whole document)", lambda: list(iter_chunks(text))),
+            ("parse_cards (6 cards)", lambda: parse_cards(SAMPLE_CARDS, 6)),
+            ("CardStreamParser (6 cards)", stream_parse),
+        ]
+        for name, func in cases:
+            self.report(name, self.time_calls(func, iterations))
+
+    def end_to_end(self, options):
+        stub = StubUpstream(latency=options['latency'],
+                            jitter=options['jitter'],
+                            error_rate=options['error_rate'],
+                            malformed_rate=options['malformed_rate'],
+                            seed=options['seed'])
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0,
+                                                      autoclobber=True)
+        try:
+            with stub, use_stub(stub):
+                refresh_catalog()
+                self.views(options)
+                self.upstream(options)
+            self.stdout.write(f"Stub traffic: {stub.counts}")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def measure(self, client, name, iterations, request, after=None):
+        timings, queries = [], []
+        for i in range(iterations):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = request(client, i)
+                timings.append(time.perf_counter() - start)
+            queries.append(len(captured))
+            if response.status_code >= 400:
+                self.stderr.write(f"{name}: HTTP {response.status_code}")
+            if after:
+                after()
+        self.report(name, timings, queries)
+
+    def views(self, options):
+        from accounts.models import CustomUser
+        from core.models import FlashcardSet, Job
+
+        iterations = options['iterations']
+        user = CustomUser.objects.create_user(
+            username='bench@example.com', email='bench@example.com',
+            password='bench')
+        client = Client()
+        client.force_login(user)
+
+        cards = [(f"Question {i}?", f"Answer {i}") for i in range(30)]
+        sets = [FlashcardSet.objects.create_with_cards(user, f"Set {i}", cards)
+                for i in range(iterations + 30)]
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        text = make_text(800, options['seed'])
+
+        self.stdout.write(f"\nViews, {iterations} requests each, "
+                          f"{len(sets)} sets of {len(cards)} cards")
+        self.measure(client, "core_view GET", iterations,
+                     lambda c, i: c.get(reverse('core')))
+        self.measure(client, "load_flashcard_set (page)", iterations,
+                     lambda c, i: c.get(reverse('load_flashcard_set',
+                                                args=[sets[i].id])))
+        self.measure(client, "load_flashcard_set (AJAX)", iterations,
+                     lambda c, i: c.get(reverse('load_flashcard_set',
+                                                args=[sets[0].id]), **ajax))
+        # Per-user quotas would start refusing after a few requests, so the
+        # window is ignored and queued jobs are dropped between requests
+        with mock.patch('core.quotas.window_count', return_value=0):
+            self.measure(client, "core_view POST generate", iterations,
+                         lambda c, i: c.post(reverse('core'), {
+                             'text_content': text,
+                             'generate_flashcard': 'true',
+                             'num_cards': 3}, **ajax),
+                         after=lambda: Job.objects.all().delete())
+        self.measure(client, "delete_flashcard_set", iterations,
+                     lambda c, i: c.post(reverse('delete_flashcard_set',
+                                                 args=[sets[-1 - i].id]),
+                                         **ajax))
+
+        timings = []
+        for i in range(min(iterations, 5)):
+            job = enqueue(user, Job.GENERATE_FLASHCARDS, text=text,
+                          num_cards=3)
+            start = time.perf_counter()
+            run_job(claim_next())
+            timings.append(time.perf_counter() - start)
+        self.report("generation job (worker)", timings)
+
+    def upstream(self, options):
+        concurrency = options['concurrency']
+        iterations = options['iterations']
+        documents = [make_text(1500, options['seed'] + i)
+                     for i in range(iterations)]
+
+        def run(func, document):
+            start = time.perf_counter()
+            result = func(document)
+            return time.perf_counter() - start, result
+
+        self.stdout.write(f"\nUpstream paths, {iterations} documents, "
+                          f"{concurrency} at a time")
+        for name, func, ok in [
+                ("summarize_text", summarize_text,
+                 lambda result: not result.startswith("Error")),
+                ("generate_flashcards (6 cards)",
+                 lambda document: generate_flashcards(document, 6),
+                 lambda result: bool(result) and len(result) == 6)]:
+            with ThreadPoolExecutor(concurrency) as pool:
+                started = time.perf_counter()
+                results = list(pool.map(lambda d: run(func, d), documents))
+                elapsed = time.perf_counter() - started
+            timings = [timing for timing, _ in results]
+            complete = sum(ok(result) for _, result in results if result)
+            self.report(name, timings)
+            self.stdout.write(f"{'':<34} {complete}/{len(results)} complete, "
+                              f"{len(results) / elapsed:.1f} docs/s overall")
@@ -0,0 +1,75 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from core.utils import (MAX_CHARS_PER_CHUNK, MAX_CHUNKS, MAX_WORDS_PER_CHUNK,
+                        chunk_text, iter_chunks)
+
+
+def legacy_chunk_text(text):
+    """The original quadratic chunker, kept here as the baseline"""
+    words = text.split()
+    chunks = []
+    current_chunk = []
+
+    for word in words:
+        current_chunk.append(word)
+        chunk_str = ' '.join(current_chunk)
+        if len(current_chunk) >= MAX_WORDS_PER_CHUNK or len(
+                chunk_str) >= MAX_CHARS_PER_CHUNK:
+            if len(current_chunk) > MAX_WORDS_PER_CHUNK or len(
+                    chunk_str) > MAX_CHARS_PER_CHUNK:
+                words_in_chunk = chunk_str.split()
+                mid = len(words_in_chunk) // 2
+                chunks.extend([' '.join(words_in_chunk[:mid]),
+                               ' '.join(words_in_chunk[mid:])])
+            else:
+                chunks.append(chunk_str)
+            current_chunk = []
+
+    if current_chunk:
+        chunks.append(' '.join(current_chunk))
+
+    return chunks[:MAX_CHUNKS]
+
+
+def make_text(num_words, seed=0):
+    """Build lorem-style text with sentences and paragraphs"""
+    rng = random.Random(seed)
+    alphabet = 'abcdefghijklmnopqrstuvwxyz'
+    words = []
+    for i in range(num_words):
+        word = ''.join(rng.choice(alphabet)
+                       for _ in range(rng.randint(2, 9)))
+        if rng.random() < 0.07:
+            word += '.'
+            if rng.random() < 0.15:
+                word += '\n\n'
+        words.append(word)
+    return ' '.join(words)
+
+
+class Command(BaseCommand):
+    help = "Compare the streaming chunker against the original chunk_text"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--words', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        text = make_text(options['words'])
+        cases = [
+            ("legacy chunk_text", legacy_chunk_text),
+            ("chunk_text", chunk_text),
+            ("iter_chunks (whole document)", lambda t: list(iter_chunks(t))),
+        ]
+
+        self.stdout.write(f"{options['words']} words, "
+                          f"best of {options['repeat']} runs")
+        for name, func in cases:
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                chunks = func(text)
+                timings.append(time.perf_counter() - start)
+            self.stdout.write(f"{name:<30} {min(timings) * 1000:10.2f} ms "
+                              f"{len(chunks):6d} chunks")
@@ -0,0 +1,45 @@
+import asyncio
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from core.jobs import JOB_CONCURRENCY, arun_job, claim_next, requeue_stale
+
+
+class Command(BaseCommand):
+    help = "Run queued summarization and flashcard generation jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=float, default=1.0,
+                            help="Seconds to wait when the queue is empty")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty")
+        parser.add_argument('--concurrency', type=int,
+                            default=JOB_CONCURRENCY,
+                            help="Jobs to run at once")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Job worker started")
+        # One event loop for the worker's lifetime, so its pooled HTTP client
+        # keeps upstream connections alive from one job to the next
+        async_to_sync(self.work)(options['poll'], options['once'],
+                                 max(1, options['concurrency']))
+
+    async def work(self, poll, once, concurrency):
+        """Run jobs side by side, so one slow generation blocks no others"""
+        await asyncio.gather(*(self.run_jobs(poll, once)
+                               for _ in range(concurrency)))
+
+    async def run_jobs(self, poll, once):
+        while True:
+            await sync_to_async(close_old_connections)()
+            await sync_to_async(requeue_stale)()
+
+            job = await sync_to_async(claim_next)()
+            if job is None:
+                if once:
+                    return
+                await asyncio.sleep(poll)
+                continue
+
+            await arun_job(job)
+            self.stdout.write(f"{job} finished")
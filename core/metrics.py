@@ -0,0 +1,161 @@
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Dict, Tuple
+from asgiref.sync import iscoroutinefunction
+
+# Seconds, from a cached page load up to a slow LLM round trip
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace(
+        '"', r'\"')
+
+
+def _label_text(names, values, extra="") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in
+             zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic per-process counter, one series per label combination"""
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values: Dict[tuple, float] = {}
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{_label_text(self.labels, key)} {value}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a running sum and count"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self.values: Dict[tuple, list] = {}
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with _lock:
+            # Per-bucket counts, then the sum; made cumulative when rendered
+            series = self.values.setdefault(
+                key, [0] * (len(self.buckets) + 1) + [0.0])
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def samples(self):
+        for key, series in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),),
+                                    series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _label_text(self.labels, key, f'le="{le}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _label_text(self.labels, key)
+            yield f"{self.name}_sum{labels} {series[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        for metric in _registry:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+def timed(function_name: str):
+    """Record how long each call to the decorated function takes"""
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.monotonic()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    function_seconds.observe(time.monotonic() - started,
+                                             function=function_name)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                function_seconds.observe(time.monotonic() - started,
+                                         function=function_name)
+        return wrapper
+    return decorator
+
+
+request_seconds = Histogram(
+    "flashstudy_request_duration_seconds",
+    "Time to build a response, by view", ("view", "method", "status"))
+request_queries = Histogram(
+    "flashstudy_request_db_queries",
+    "Database queries issued per request", ("view",), QUERY_BUCKETS)
+request_query_seconds = Histogram(
+    "flashstudy_request_db_seconds",
+    "Time spent in database queries per request", ("view",))
+slow_requests = Counter(
+    "flashstudy_slow_requests_total",
+    "Requests slower than SLOW_REQUEST_SECONDS", ("view",))
+
+upstream_seconds = Histogram(
+    "flashstudy_upstream_duration_seconds",
+    "Latency of outbound API calls until headers arrive",
+    ("provider", "model", "status"))
+upstream_bytes = Counter(
+    "flashstudy_upstream_response_bytes_total",
+    "Response bytes received from outbound API calls", ("provider",))
+model_attempts = Histogram(
+    "flashstudy_model_attempt_seconds",
+    "Duration of each card request to a model, by outcome",
+    ("model", "outcome"))
+function_seconds = Histogram(
+    "flashstudy_function_duration_seconds",
+    "Duration of instrumented functions", ("function",))
+card_parses = Counter(
+    "flashstudy_card_parses_total",
+    "Model completions parsed, by output format and result",
+    ("format", "result"))
+summary_cache_lookups = Counter(
+    "flashstudy_summary_cache_lookups_total",
+    "Chunk summary cache lookups, by result", ("result",))
+llm_calls_saved = Counter(
+    "flashstudy_llm_calls_saved_total",
+    "Completions the strict pipe parser would have discarded but that "
+    "yielded cards")
@@ -0,0 +1,104 @@
+import logging
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from decouple import config
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Requests slower than this are logged with their query count, 0 disables
+SLOW_REQUEST_SECONDS = config("SLOW_REQUEST_SECONDS", default=2.0,
+                              cast=float)
+
+
+class QueryTimer:
+    """connection.execute_wrapper hook counting queries and their time"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.monotonic() - started
+
+
+# The timer of the request being handled. Context variables follow the
+# request into the threads sync_to_async runs its queries in.
+_request_queries = ContextVar("request_queries", default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    """execute_wrapper feeding the current request's QueryTimer, if any"""
+    queries = _request_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    return queries(execute, sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """connection_created receiver putting count_queries on each connection"""
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+class MetricsMiddleware:
+    """Time every request and count the database queries it makes
+
+    Queries are counted on whichever thread's connection runs them, so
+    async views and sync views served over ASGI are counted too. Streaming
+    responses are timed up to the first byte.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        queries = QueryTimer()
+        token = _request_queries.set(queries)
+        started = time.monotonic()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self.record(request, response, time.monotonic() - started, queries)
+        return response
+
+    async def __acall__(self, request):
+        queries = QueryTimer()
+        token = _request_queries.set(queries)
+        started = time.monotonic()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self.record(request, response, time.monotonic() - started, queries)
+        return response
+
+    def record(self, request, response, duration, queries):
+        match = request.resolver_match
+        view = match.view_name if match else "unresolved"
+        metrics.request_seconds.observe(duration, view=view,
+                                        method=request.method,
+                                        status=response.status_code)
+        metrics.request_queries.observe(queries.count, view=view)
+        metrics.request_query_seconds.observe(queries.seconds, view=view)
+
+        if SLOW_REQUEST_SECONDS and duration >= SLOW_REQUEST_SECONDS:
+            metrics.slow_requests.inc(view=view)
+            logger.warning(
+                "Slow request: %s %s took %.2fs (%s, %s queries in %.2fs)",
+                request.method, request.path, duration, view,
+                queries.count, queries.seconds)
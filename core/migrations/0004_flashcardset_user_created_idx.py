@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='flashcardset',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='flashcardset_user_created_idx'),
+        ),
+    ]
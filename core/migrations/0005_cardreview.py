@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:41
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_reviews(apps, schema_editor):
+    """Give every existing card a review row that is due now"""
+    Flashcard = apps.get_model('core', 'Flashcard')
+    CardReview = apps.get_model('core', 'CardReview')
+
+    cards = Flashcard.objects.values_list(
+        'id', 'flashcard_set__user_id').iterator(chunk_size=2000)
+    batch = []
+    for card_id, user_id in cards:
+        batch.append(CardReview(card_id=card_id, user_id=user_id))
+        if len(batch) >= 2000:
+            CardReview.objects.bulk_create(batch)
+            batch = []
+    CardReview.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_flashcardset_user_created_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardReview',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ease_factor', models.FloatField(default=2.5)),
+                ('interval_days', models.PositiveIntegerField(default=0)),
+                ('repetitions', models.PositiveIntegerField(default=0)),
+                ('due_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_reviewed_at', models.DateTimeField(blank=True, null=True)),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reviews', to='core.flashcard')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='card_reviews', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'due_at'], name='cardreview_user_due_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'card'), name='unique_card_review')],
+            },
+        ),
+        migrations.RunPython(create_reviews, migrations.RunPython.noop),
+    ]
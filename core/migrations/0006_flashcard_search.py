@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:42
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    "CREATE INDEX flashcard_search_gin ON core_flashcard "
+    "USING gin (search_vector)",
+    "CREATE TRIGGER flashcard_search_update BEFORE INSERT OR UPDATE "
+    "ON core_flashcard FOR EACH ROW EXECUTE FUNCTION "
+    "tsvector_update_trigger(search_vector, 'pg_catalog.english', "
+    "question, answer)",
+    # Touch every row so the trigger fills in existing cards
+    "UPDATE core_flashcard SET question = question",
+]
+
+POSTGRES_REVERSE = [
+    "DROP TRIGGER IF EXISTS flashcard_search_update ON core_flashcard",
+    "DROP INDEX IF EXISTS flashcard_search_gin",
+]
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE core_flashcard_fts USING fts5("
+    "question, answer, content='core_flashcard', content_rowid='id')",
+    "CREATE TRIGGER core_flashcard_fts_insert AFTER INSERT ON core_flashcard "
+    "BEGIN INSERT INTO core_flashcard_fts(rowid, question, answer) "
+    "VALUES (new.id, new.question, new.answer); END",
+    "CREATE TRIGGER core_flashcard_fts_delete AFTER DELETE ON core_flashcard "
+    "BEGIN INSERT INTO core_flashcard_fts(core_flashcard_fts, rowid, "
+    "question, answer) VALUES ('delete', old.id, old.question, old.answer); "
+    "END",
+    "CREATE TRIGGER core_flashcard_fts_update AFTER UPDATE ON core_flashcard "
+    "BEGIN INSERT INTO core_flashcard_fts(core_flashcard_fts, rowid, "
+    "question, answer) VALUES ('delete', old.id, old.question, old.answer); "
+    "INSERT INTO core_flashcard_fts(rowid, question, answer) "
+    "VALUES (new.id, new.question, new.answer); END",
+    "INSERT INTO core_flashcard_fts(core_flashcard_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS core_flashcard_fts_insert",
+    "DROP TRIGGER IF EXISTS core_flashcard_fts_delete",
+    "DROP TRIGGER IF EXISTS core_flashcard_fts_update",
+    "DROP TABLE IF EXISTS core_flashcard_fts",
+]
+
+
+def _run(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    """GIN-indexed tsvector on PostgreSQL, an FTS5 table on SQLite"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_FORWARD)
+    elif vendor == 'sqlite':
+        _run(schema_editor, SQLITE_FORWARD)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_REVERSE)
+    elif vendor == 'sqlite':
+        _run(schema_editor, SQLITE_REVERSE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_cardreview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flashcard',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
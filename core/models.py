@@ -1,19 +1,88 @@
-from django.db import models
+from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.utils import timezone
 from FlashStudy.settings import AUTH_USER_MODEL
 
 
+class FlashcardSetManager(models.Manager):
+    def create_with_cards(self, user, title, cards, batch_size=None):
+        """Create a set and all of its cards in one transaction
+
+        Cards are inserted with bulk_create, so the number of queries
+        depends on the batch size rather than on the number of cards.
+        """
+        batch_size = batch_size or settings.FLASHCARD_BULK_BATCH_SIZE
+        with transaction.atomic():
+            flashcard_set = self.create(title=title, user=user)
+            created = Flashcard.objects.bulk_create(
+                [Flashcard(flashcard_set=flashcard_set, question=question,
+                           answer=answer) for question, answer in cards],
+                batch_size=batch_size)
+
+            # Backends that cannot return ids from a bulk insert need a read
+            if created and created[0].pk is None:
+                created = list(flashcard_set.cards.only('id'))
+
+            # New cards are due for study straight away
+            CardReview.objects.bulk_create(
+                [CardReview(user=user, card=card) for card in created],
+                batch_size=batch_size)
+        return flashcard_set
+
+
 class FlashcardSet(models.Model):
     title = models.CharField(max_length=200)
     user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = FlashcardSetManager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'],
+                         name='flashcardset_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.user.username}"
 
+    def touch(self):
+        """Mark the set as changed after its cards were edited"""
+        FlashcardSet.objects.filter(pk=self.pk).update(
+            updated_at=timezone.now())
+
+
+class FlashcardQuerySet(models.QuerySet):
+    """Bulk edits and deletes of cards also bump their sets' versions
+
+    Cascading deletes skip QuerySet.delete, so deleting a set stays cheap.
+    """
+
+    def _set_ids(self):
+        return list(self.order_by().values_list('flashcard_set_id',
+                                                flat=True).distinct())
+
+    def _touch_sets(self, set_ids):
+        FlashcardSet.objects.filter(pk__in=set_ids).update(
+            updated_at=timezone.now())
+
+    def update(self, **kwargs):
+        with transaction.atomic():
+            set_ids = self._set_ids()
+            rows = super().update(**kwargs)
+            self._touch_sets(set_ids)
+        return rows
+
+    def delete(self):
+        with transaction.atomic():
+            set_ids = self._set_ids()
+            result = super().delete()
+            self._touch_sets(set_ids)
+        return result
+
 
 class Flashcard(models.Model):
     flashcard_set = models.ForeignKey(FlashcardSet, on_delete=models.CASCADE,
@@ -21,6 +90,104 @@ class Flashcard(models.Model):
     question = models.TextField()
     answer = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Filled by a database trigger on PostgreSQL, see migration 0006
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = FlashcardQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.question[:50]}..."
+
+    # Editing a single card changes its set's version, as FlashcardQuerySet
+    # does for bulk edits
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            CardReview.objects.get_or_create(user_id=self.flashcard_set.user_id,
+                                             card=self)
+        self.flashcard_set.touch()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self.flashcard_set.touch()
+        return result
+
+
+class CardReview(models.Model):
+    """A user's spaced-repetition state for one card"""
+    user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE,
+                             related_name='card_reviews')
+    card = models.ForeignKey(Flashcard, on_delete=models.CASCADE,
+                             related_name='reviews')
+    ease_factor = models.FloatField(default=2.5)
+    interval_days = models.PositiveIntegerField(default=0)
+    repetitions = models.PositiveIntegerField(default=0)
+    due_at = models.DateTimeField(default=timezone.now)
+    last_reviewed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'card'],
+                                    name='unique_card_review'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'due_at'],
+                         name='cardreview_user_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.card} due {self.due_at:%Y-%m-%d}"
+
+
+class SummaryCacheEntry(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    summary = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.key[:12]} - {self.summary[:50]}"
+
+
+class Job(models.Model):
+    SUMMARIZE = 'summarize'
+    GENERATE_FLASHCARDS = 'generate_flashcards'
+    KIND_CHOICES = [
+        (SUMMARIZE, 'Summarize'),
+        (GENERATE_FLASHCARDS, 'Generate flashcards'),
+    ]
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE,
+                             related_name='jobs')
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES,
+                              default=PENDING)
+    payload = models.JSONField(default=dict)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    progress = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
@@ -0,0 +1,53 @@
+import base64
+from datetime import datetime
+from typing import List, Optional, Tuple
+from decouple import config
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from .models import Flashcard, FlashcardSet
+
+SIDEBAR_PAGE_SIZE = config("SIDEBAR_PAGE_SIZE", default=25, cast=int)
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(flashcard_set) -> str:
+    raw = f"{flashcard_set.created_at.isoformat()}|{flashcard_set.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_cursor, raises ValueError for a bad cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, pk = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(pk)
+    except (UnicodeError, ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def flashcard_set_page(user, cursor: Optional[str] = None,
+                       limit: int = SIDEBAR_PAGE_SIZE
+                       ) -> Tuple[List[FlashcardSet], Optional[str]]:
+    """One page of the user's sets, newest first, with card counts
+
+    Keyset pagination on (created_at, id) walks the (user, -created_at, -id)
+    index, so every page costs the same single query however many sets the
+    user has. Card counts come from a correlated subquery that only runs
+    for the rows on the page.
+    """
+    card_count = Flashcard.objects.filter(
+        flashcard_set=OuterRef('pk')).values('flashcard_set').annotate(
+        count=Count('*')).values('count')
+
+    sets = FlashcardSet.objects.filter(user=user).annotate(
+        card_count=Coalesce(Subquery(card_count, output_field=IntegerField()),
+                            0)).order_by('-created_at', '-id')
+
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        sets = sets.filter(Q(created_at__lt=created_at) |
+                           Q(created_at=created_at, id__lt=pk))
+
+    page = list(sets[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
@@ -0,0 +1,115 @@
+import re
+from typing import List, Tuple
+from . import metrics
+
+# Labels for the formats parse_pairs recognises, in order of preference
+PIPES = 'pipes'
+LINES = 'lines'
+QA = 'q_a'
+NUMBERED = 'numbered'
+
+MAX_QUESTION_CHARS = 500
+MAX_ANSWER_CHARS = 2000
+
+QA_LABEL = re.compile(
+    r'(?:^|(?<=\s))(?:\d+[.)]\s*)?\**(?P<label>question|answer|q|a)\s*\d*'
+    r'\s*\**\s*:\**', re.IGNORECASE | re.MULTILINE)
+NUMBERED_ITEM = re.compile(
+    r'^\s*\d+[.)]\s+(?P<question>[^\n]+?\?)\s*(?:[-–—:]\s*|\n\s*)'
+    r'(?P<answer>[^\n]+)', re.MULTILINE)
+
+
+def _clean(text: str) -> str:
+    return text.strip().strip('*_"\'` ').strip()
+
+
+def _valid(question: str, answer: str) -> bool:
+    return bool(question and answer) and \
+        len(question) <= MAX_QUESTION_CHARS and \
+        len(answer) <= MAX_ANSWER_CHARS
+
+
+def _pairs(raw) -> List[Tuple[str, str]]:
+    pairs = []
+    for question, answer in raw:
+        question, answer = _clean(question), _clean(answer)
+        if _valid(question, answer):
+            pairs.append((question, answer))
+    return pairs
+
+
+def _pipes(content):
+    # The requested |Question $$ Answer| format. An odd pipe count means the
+    # completion was cut off inside the last card, so that card is dropped.
+    if "|" not in content:
+        return []
+    items = content.split("|")
+    if len(items) % 2 == 0:
+        items.pop()
+    return _pairs(item.split("$$", 1) for item in items if "$$" in item)
+
+
+def _lines(content):
+    # Question $$ Answer one per line, with the pipes forgotten
+    return _pairs(line.lstrip('0123456789.) -').split("$$", 1)
+                  for line in content.splitlines()
+                  if "$$" in line and "|" not in line)
+
+
+def _q_a(content):
+    # Q:/A: or Question:/Answer: labels, optionally numbered or in bold
+    labels = list(QA_LABEL.finditer(content))
+    raw = []
+    for label, following in zip(labels, labels[1:] + [None]):
+        kind = label.group('label')[0].lower()
+        text = content[label.end():following.start() if following else None]
+        if kind == 'q':
+            raw.append([text, None])
+        elif raw and raw[-1][1] is None:
+            raw[-1][1] = text
+    return _pairs((question, answer) for question, answer in raw
+                  if answer is not None)
+
+
+def _numbered(content):
+    return _pairs((match.group('question'), match.group('answer'))
+                  for match in NUMBERED_ITEM.finditer(content))
+
+
+PARSERS = ((PIPES, _pipes), (LINES, _lines), (QA, _q_a),
+           (NUMBERED, _numbered))
+
+
+def parse_pairs(content: str) -> Tuple[List[Tuple[str, str]], str]:
+    """Every question/answer pair found in a completion, and its format
+
+    Each known format is tried and the one yielding the most pairs wins;
+    formats are never mixed, so a pair is not counted twice. Returns an
+    empty list and None when nothing parses.
+    """
+    best, best_format = [], None
+    for name, parser in PARSERS:
+        pairs = parser(content or "")
+        if len(pairs) > len(best):
+            best, best_format = pairs, name
+    return best, best_format
+
+
+def parse_completion(content: str, number: int) -> List[Tuple[str, str]]:
+    """Up to `number` pairs from a completion, recording parse metrics
+
+    A short list is still returned so the caller only re-requests the
+    missing cards. Responses the strict pipe rule would have thrown away
+    but that yielded pairs are counted as saved calls.
+    """
+    pairs, found_format = parse_pairs(content)
+    if not pairs:
+        metrics.card_parses.inc(format="none", result="failed")
+        return []
+
+    complete = len(pairs) >= number
+    metrics.card_parses.inc(format=found_format,
+                            result="complete" if complete else "partial")
+    if len(_pipes(content)) < number:
+        metrics.llm_calls_saved.inc()
+    return pairs[:number]
@@ -0,0 +1,229 @@
+import time
+from functools import wraps
+from typing import Optional
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from decouple import config
+from django.core.cache import cache
+from django.http import JsonResponse
+from .models import Job
+
+# Generation/summarize requests a user may start per window
+GENERATION_QUOTA = config("GENERATION_QUOTA", default=30, cast=int)
+GENERATION_QUOTA_WINDOW = config("GENERATION_QUOTA_WINDOW", default=3600,
+                                 cast=int)
+# Streams a user may hold open at once, each one pins a web worker
+MAX_CONCURRENT_STREAMS = config("MAX_CONCURRENT_STREAMS", default=2, cast=int)
+# Queued or running jobs a user may have at once
+MAX_ACTIVE_JOBS = config("MAX_ACTIVE_JOBS", default=3, cast=int)
+# Upper bound on how long a leaked concurrency slot survives a crash
+SLOT_TIMEOUT = 600
+
+
+def _too_many(error, retry_after):
+    response = JsonResponse({'success': False, 'error': error}, status=429)
+    response['Retry-After'] = str(max(1, int(retry_after)))
+    return response
+
+
+def window_count(scope, user_id, window, now=None) -> float:
+    """Sliding-window estimate from the current and previous fixed windows"""
+    now = time.time() if now is None else now
+    index, elapsed = divmod(now, window)
+    current = cache.get(f"quota:{scope}:{user_id}:{int(index)}", 0)
+    previous = cache.get(f"quota:{scope}:{user_id}:{int(index) - 1}", 0)
+    return current + previous * (1 - elapsed / window)
+
+
+def _spend(scope, user_id, window, now) -> str:
+    """Count one request in the current window and return its key"""
+    key = f"quota:{scope}:{user_id}:{int(now // window)}"
+    cache.add(key, 0, window * 2)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Expired between add and incr
+        cache.set(key, 1, window * 2)
+    return key
+
+
+def _refund(key):
+    try:
+        cache.decr(key)
+    except ValueError:
+        pass
+
+
+def _reserve(scope, user_id, limit, window) -> Optional[str]:
+    """Spend one request up front, None if that puts the user over limit
+
+    Counting before checking, as _take_slot does, stops concurrent requests
+    from all passing the check before any of them is counted.
+    """
+    now = time.time()
+    key = _spend(scope, user_id, window, now)
+    # The estimate now includes this request
+    if window_count(scope, user_id, window, now) - 1 >= limit:
+        _refund(key)
+        return None
+    return key
+
+
+def _take_slot(scope, user_id, limit) -> bool:
+    key = f"concurrency:{scope}:{user_id}"
+    cache.add(key, 0, SLOT_TIMEOUT)
+    try:
+        taken = cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, SLOT_TIMEOUT)
+        taken = 1
+    if taken > limit:
+        _release_slot(scope, user_id)
+        return False
+    return True
+
+
+def _release_slot(scope, user_id):
+    try:
+        cache.decr(f"concurrency:{scope}:{user_id}")
+    except ValueError:
+        pass
+
+
+class _SlotRelease:
+    """Free a stream's slot once it ends or is closed
+
+    Closing covers clients that hang up before the first chunk, when a
+    generator's finally block would never run.
+    """
+
+    def __init__(self, content, scope, user_id):
+        self.content = content
+        self.slot = (scope, user_id)
+        self.closed = False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            _release_slot(*self.slot)
+
+
+class _SlotStream(_SlotRelease):
+    def __iter__(self):
+        try:
+            yield from self.content
+        finally:
+            self.close()
+
+
+class _AsyncSlotStream(_SlotRelease):
+    # Only __aiter__, Django serves anything iter() accepts synchronously
+    async def __aiter__(self):
+        try:
+            async for chunk in self.content:
+                yield chunk
+        finally:
+            self.close()
+
+
+def user_quota(scope, limit=GENERATION_QUOTA, window=GENERATION_QUOTA_WINDOW,
+               concurrency=None, active_jobs=None, applies=None):
+    """Per-user sliding-window quota and concurrency limit for a view
+
+    Requests over any limit get an immediate 429 with Retry-After instead
+    of occupying a worker. `applies(request)` narrows the limit to some of
+    the requests a view handles; the rest pass straight through. Streaming
+    responses keep their concurrency slot until the stream is closed.
+    Works on both sync and async views.
+    """
+    def admit(user):
+        """Reserve the user's quota and slot, returning (key, refusal)"""
+        key = None
+        if limit:
+            key = _reserve(scope, user.id, limit, window)
+            if key is None:
+                return None, _too_many(
+                    'Generation quota exceeded, try again later.',
+                    window / limit)
+
+        refusal = None
+        if active_jobs and Job.objects.filter(
+                user=user, status__in=(Job.PENDING, Job.RUNNING)
+        ).count() >= active_jobs:
+            refusal = _too_many('Too many jobs in progress, wait for one to '
+                                'finish.', 5)
+        elif concurrency and not _take_slot(scope, user.id, concurrency):
+            refusal = _too_many('Too many requests in progress.', 5)
+        if refusal and key:
+            _refund(key)
+        return key, refusal
+
+    def abandon(key, user):
+        # The view failed, so neither its quota nor its slot is used up
+        if key:
+            _refund(key)
+        if concurrency:
+            _release_slot(scope, user.id)
+
+    def settle(response, key, user):
+        if response.status_code >= 400 and key:
+            _refund(key)
+        if concurrency:
+            if response.streaming:
+                stream = (_AsyncSlotStream if response.is_async
+                          else _SlotStream)
+                response.streaming_content = stream(
+                    response.streaming_content, scope, user.id)
+            else:
+                _release_slot(scope, user.id)
+        return response
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                user = await request.auser()
+                if not user.is_authenticated or (applies and
+                                                 not applies(request)):
+                    return await view(request, *args, **kwargs)
+
+                key, refusal = await sync_to_async(admit)(user)
+                if refusal:
+                    return refusal
+                try:
+                    response = await view(request, *args, **kwargs)
+                except BaseException:
+                    await sync_to_async(abandon)(key, user)
+                    raise
+                return await sync_to_async(settle)(response, key, user)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            user = request.user
+            if not user.is_authenticated or (applies and
+                                             not applies(request)):
+                return view(request, *args, **kwargs)
+
+            key, refusal = admit(user)
+            if refusal:
+                return refusal
+            try:
+                response = view(request, *args, **kwargs)
+            except BaseException:
+                abandon(key, user)
+                raise
+            return settle(response, key, user)
+        return wrapper
+    return decorator
+
+
+def starts_upstream_work(request) -> bool:
+    """core_view POSTs that summarize or generate, not saves or page loads
+
+    Fast summaries and instant cards run locally and are not counted.
+    """
+    return request.method == "POST" and (
+        ("summarize" in request.POST and
+         request.POST["summarize"] != "fast") or
+        ("generate_flashcard" in request.POST and
+         request.POST["generate_flashcard"] != "instant"))
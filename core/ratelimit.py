@@ -0,0 +1,244 @@
+import asyncio
+import hashlib
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from decouple import config
+from django.core.cache import cache
+from django.utils.http import parse_http_date_safe
+from . import metrics
+from .http import async_session, session
+
+# Token buckets per provider: sustained requests per second and burst size
+RATE_LIMITS = {
+    'huggingface': (config("HF_RATE_PER_SECOND", default=5.0, cast=float),
+                    config("HF_RATE_BURST", default=10, cast=int)),
+    'openrouter': (config("OR_RATE_PER_SECOND", default=0.5, cast=float),
+                   config("OR_RATE_BURST", default=5, cast=int)),
+}
+# Longest a caller waits for a token before giving up
+RATE_LIMIT_MAX_WAIT = config("RATE_LIMIT_MAX_WAIT", default=10.0, cast=float)
+
+# Seconds before trying again when another caller holds a bucket's lock
+LOCK_RETRY = 0.05
+
+MAX_RETRIES = config("UPSTREAM_MAX_RETRIES", default=2, cast=int)
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+RETRY_STATUSES = {429, 502, 503, 504}
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+class RateLimitExceeded(requests.RequestException):
+    """No token became available within RATE_LIMIT_MAX_WAIT"""
+
+
+def _count(provider, name, amount=1):
+    with _counters_lock:
+        provider_counters = _counters.setdefault(provider, {
+            "requests": 0,
+            "throttled_waits": 0,
+            "throttled_seconds": 0.0,
+            "retries": 0,
+            "rate_limited_responses": 0,
+            "rejected": 0,
+        })
+        provider_counters[name] += amount
+
+
+def stats() -> dict:
+    """Per-provider counters for this process"""
+    with _counters_lock:
+        return {provider: dict(counters)
+                for provider, counters in _counters.items()}
+
+
+def _bucket_key(provider, api_key) -> str:
+    key_hash = hashlib.sha256((api_key or "").encode()).hexdigest()[:12]
+    return f"ratelimit:{provider}:{key_hash}"
+
+
+@contextmanager
+def cache_lock(key, timeout=2):
+    """Hold the lock on key, yielding False if it could not be taken in time"""
+    # cache.add is atomic on every backend, so it doubles as a mutex that
+    # gunicorn workers share when the cache is Redis. The lock expires by
+    # itself after timeout seconds should its holder die.
+    lock_key = f"{key}:lock"
+    deadline = time.monotonic() + timeout
+    while not (locked := cache.add(lock_key, True, timeout)):
+        if time.monotonic() > deadline:
+            break
+        time.sleep(0.005)
+    try:
+        yield locked
+    finally:
+        # Never release a lock some other caller is holding
+        if locked:
+            cache.delete(lock_key)
+
+
+def _take_token(key, rate, burst) -> float:
+    """Take a token if one is available, else return seconds to wait"""
+    with cache_lock(key) as locked:
+        if not locked:
+            return LOCK_RETRY
+        now = time.time()
+        state = cache.get(key) or {"tokens": float(burst), "updated": now,
+                                   "blocked_until": 0.0}
+        if state["blocked_until"] > now:
+            return state["blocked_until"] - now
+
+        state["tokens"] = min(float(burst), state["tokens"] +
+                              (now - state["updated"]) * rate)
+        state["updated"] = now
+        if state["tokens"] >= 1:
+            state["tokens"] -= 1
+            wait = 0.0
+        else:
+            wait = (1 - state["tokens"]) / rate
+        cache.set(key, state, 3600)
+        return wait
+
+
+def _token_wait(provider, api_key, deadline) -> float:
+    """Seconds to sleep before trying again, 0 once a token was taken"""
+    rate, burst = RATE_LIMITS[provider]
+    wait = _take_token(_bucket_key(provider, api_key), rate, burst)
+    if wait <= 0:
+        _count(provider, "requests")
+        return 0.0
+    if time.monotonic() + wait > deadline:
+        _count(provider, "rejected")
+        raise RateLimitExceeded(f"{provider} rate limit, retry in "
+                                f"{wait:.1f}s")
+    _count(provider, "throttled_waits")
+    _count(provider, "throttled_seconds", wait)
+    return wait
+
+
+def acquire(provider: str, api_key: str = "",
+            max_wait: float = RATE_LIMIT_MAX_WAIT):
+    """Block until the provider's bucket for this key has a token"""
+    deadline = time.monotonic() + max_wait
+    while wait := _token_wait(provider, api_key, deadline):
+        time.sleep(wait)
+
+
+async def aacquire(provider: str, api_key: str = "",
+                   max_wait: float = RATE_LIMIT_MAX_WAIT):
+    """acquire() that yields to the event loop while throttled"""
+    deadline = time.monotonic() + max_wait
+    # The bucket lives in the cache, so each check runs off the loop
+    token_wait = sync_to_async(_token_wait, thread_sensitive=False)
+    while wait := await token_wait(provider, api_key, deadline):
+        await asyncio.sleep(wait)
+
+
+def block(provider: str, api_key: str, seconds: float):
+    """Pause every worker's calls to a provider, e.g. after a 429"""
+    key = _bucket_key(provider, api_key)
+    with cache_lock(key) as locked:
+        # The caller still backs off by itself if the bucket stays busy
+        if not locked:
+            return
+        rate, burst = RATE_LIMITS[provider]
+        state = cache.get(key) or {"tokens": float(burst),
+                                   "updated": time.time(),
+                                   "blocked_until": 0.0}
+        state["blocked_until"] = max(state["blocked_until"],
+                                     time.time() + seconds)
+        cache.set(key, state, 3600)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After as seconds, from either delta-seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        timestamp = parse_http_date_safe(value)
+        return max(0.0, timestamp - time.time()) if timestamp else None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Exponential backoff with full jitter, never sooner than Retry-After"""
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def request_with_backoff(provider: str, api_key: str, method: str, url: str,
+                         acquired: bool = False,
+                         **kwargs) -> requests.Response:
+    """Rate-limited request that retries 429 and 5xx answers
+
+    A 429 carrying Retry-After also blocks the provider for every worker
+    sharing the cache, not just this caller. Pass acquired=True when the
+    caller already took the token for the first attempt.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt or not acquired:
+            acquire(provider, api_key)
+        started = time.monotonic()
+        response = session.request(method, url, **kwargs)
+        _observe(provider, kwargs, response, time.monotonic() - started,
+                 streamed=kwargs.get('stream', False))
+        if response.status_code not in RETRY_STATUSES or \
+                attempt == MAX_RETRIES:
+            return response
+
+        delay = _retry_delay(provider, api_key, response, attempt)
+        response.close()
+        time.sleep(delay)
+    return response
+
+
+async def arequest_with_backoff(provider: str, api_key: str, method: str,
+                                url: str, acquired: bool = False,
+                                **kwargs) -> httpx.Response:
+    """request_with_backoff() over the pooled async client"""
+    client = async_session()
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt or not acquired:
+            await aacquire(provider, api_key)
+        started = time.monotonic()
+        response = await client.request(method, url, **kwargs)
+        _observe(provider, kwargs, response, time.monotonic() - started)
+        if response.status_code not in RETRY_STATUSES or \
+                attempt == MAX_RETRIES:
+            return response
+
+        await asyncio.sleep(await sync_to_async(
+            _retry_delay, thread_sensitive=False)(provider, api_key,
+                                                  response, attempt))
+    return response
+
+
+def _observe(provider, kwargs, response, latency, streamed=False):
+    model = (kwargs.get('json') or {}).get('model', '')
+    metrics.upstream_seconds.observe(latency, provider=provider, model=model,
+                                     status=response.status_code)
+    # A streamed body has not been read yet, trust Content-Length for it
+    size = (int(response.headers.get('Content-Length') or 0) if streamed
+            else len(response.content))
+    metrics.upstream_bytes.inc(size, provider=provider)
+
+
+def _retry_delay(provider, api_key, response, attempt) -> float:
+    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+    if response.status_code == 429:
+        _count(provider, "rate_limited_responses")
+        if retry_after:
+            block(provider, api_key, retry_after)
+    _count(provider, "retries")
+    return backoff_delay(attempt, retry_after)
@@ -0,0 +1,127 @@
+import time
+from typing import Dict, List, Optional
+from decouple import config
+from django.core.cache import cache
+from . import metrics
+from .ratelimit import cache_lock
+
+SUCCESS = 'success'
+ERROR = 'error'
+PARSE_FAILURE = 'parse_failure'
+
+# Latency assumed for models that have never been tried
+DEFAULT_LATENCY = config("MODEL_DEFAULT_LATENCY", default=15.0, cast=float)
+LATENCY_SAMPLES = config("MODEL_LATENCY_SAMPLES", default=50, cast=int)
+# Consecutive failures that open a model's circuit, and for how long
+BREAKER_THRESHOLD = config("MODEL_BREAKER_THRESHOLD", default=3, cast=int)
+BREAKER_COOLDOWN = config("MODEL_BREAKER_COOLDOWN", default=300, cast=int)
+STATS_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def _key(model: str) -> str:
+    return f"model_stats:{model}"
+
+
+def _empty_stats() -> dict:
+    return {
+        "attempts": 0,
+        "successes": 0,
+        "failures": 0,
+        "parse_failures": 0,
+        "latencies": [],
+        "consecutive_failures": 0,
+        "open_until": 0.0,
+    }
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def record(model: str, outcome: str, latency: float):
+    """Add one attempt's outcome and latency to the model's stats"""
+    metrics.model_attempts.observe(latency, model=model, outcome=outcome)
+    # Every worker updates the same entry, so a process lock is not enough
+    with cache_lock(_key(model)) as locked:
+        if not locked:
+            # Dropping one sample beats overwriting another worker's update
+            return
+        stats = cache.get(_key(model)) or _empty_stats()
+        stats["attempts"] += 1
+        stats["latencies"] = (stats["latencies"] + [latency])[
+                             -LATENCY_SAMPLES:]
+
+        if outcome == SUCCESS:
+            stats["successes"] += 1
+            stats["consecutive_failures"] = 0
+            stats["open_until"] = 0.0
+        else:
+            if outcome == PARSE_FAILURE:
+                stats["parse_failures"] += 1
+            else:
+                stats["failures"] += 1
+            stats["consecutive_failures"] += 1
+            if stats["consecutive_failures"] >= BREAKER_THRESHOLD:
+                stats["open_until"] = time.time() + BREAKER_COOLDOWN
+
+        cache.set(_key(model), stats, STATS_TIMEOUT)
+
+
+def get_stats(models: List[str]) -> Dict[str, dict]:
+    found = cache.get_many([_key(model) for model in models])
+    return {model: found.get(_key(model)) or _empty_stats()
+            for model in models}
+
+
+def is_open(stats: dict) -> bool:
+    """True while the circuit is open and the model should be skipped"""
+    return stats["open_until"] > time.time()
+
+
+def expected_time(stats: dict) -> float:
+    """Median latency divided by a smoothed success rate
+
+    A model that answers in 5 s half of the time costs about 10 s per valid
+    result. Unseen models start from DEFAULT_LATENCY and a 50% prior.
+    """
+    latency = percentile(stats["latencies"], 0.5) or DEFAULT_LATENCY
+    success_rate = (stats["successes"] + 1) / (stats["attempts"] + 2)
+    return latency / success_rate
+
+
+def rank_models(models: List[str]) -> List[str]:
+    """Order models by expected time to a valid result, skipping open circuits
+
+    If every circuit is open the full ranking is returned, so callers
+    always have something to try.
+    """
+    stats = get_stats(models)
+    ranked = sorted(models, key=lambda model: expected_time(stats[model]))
+    healthy = [model for model in ranked if not is_open(stats[model])]
+    return healthy or ranked
+
+
+def summarize_stats(model: str, stats: dict) -> dict:
+    attempts = stats["attempts"]
+    return {
+        "model": model,
+        "attempts": attempts,
+        "success_rate": stats["successes"] / attempts if attempts else None,
+        "parse_failure_rate": stats["parse_failures"] / attempts if attempts
+        else None,
+        "p50_latency": percentile(stats["latencies"], 0.5),
+        "p95_latency": percentile(stats["latencies"], 0.95),
+        "expected_time": expected_time(stats),
+        "circuit_open": is_open(stats),
+    }
+
+
+def scoreboard(models: List[str]) -> List[dict]:
+    """Per-model stats in ranking order, for the status view"""
+    stats = get_stats(models)
+    rows = [summarize_stats(model, stats[model]) for model in models]
+    return sorted(rows, key=lambda row: row["expected_time"])
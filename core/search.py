@@ -0,0 +1,100 @@
+import re
+from typing import List, Tuple
+from decouple import config
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, Q
+from .models import Flashcard
+
+SEARCH_PAGE_SIZE = config("SEARCH_PAGE_SIZE", default=20, cast=int)
+SEARCH_CONFIG = 'english'
+
+SQLITE_SEARCH = """
+    SELECT card.id, card.question, card.answer, card_set.id, card_set.title,
+           bm25(core_flashcard_fts) AS rank
+    FROM core_flashcard_fts
+    JOIN core_flashcard AS card ON card.id = core_flashcard_fts.rowid
+    JOIN core_flashcardset AS card_set ON card_set.id = card.flashcard_set_id
+    WHERE core_flashcard_fts MATCH %s AND card_set.user_id = %s
+    ORDER BY rank, card.id
+    LIMIT %s OFFSET %s
+"""
+
+
+def _result(card_id, question, answer, set_id, set_title, rank) -> dict:
+    return {
+        "card_id": card_id,
+        "question": question,
+        "answer": answer,
+        "set_id": set_id,
+        "set_title": set_title,
+        "rank": rank,
+    }
+
+
+def fts5_query(query: str) -> str:
+    """Quote each word so user input can't inject FTS5 syntax
+
+    As in PostgreSQL's websearch syntax, a bare "or" between words matches
+    either side and any other word is required. A stray "or", say left
+    over from pasted FTS syntax, is dropped rather than searched for.
+    """
+    groups = [[]]
+    for word in re.findall(r'\w+', query):
+        if word.lower() == 'or':
+            groups.append([])
+        else:
+            groups[-1].append(f'"{word}"')
+    groups = [group for group in groups if group]
+    if not groups:
+        return ""
+    # Let the last word match as a prefix while the user is still typing
+    groups[-1][-1] += '*'
+    return ' OR '.join(' '.join(group) for group in groups)
+
+
+def _search_postgresql(user, query, limit, offset):
+    search_query = SearchQuery(query, search_type='websearch',
+                               config=SEARCH_CONFIG)
+    cards = Flashcard.objects.filter(
+        flashcard_set__user=user, search_vector=search_query).annotate(
+        rank=SearchRank(F('search_vector'), search_query)).order_by(
+        '-rank', 'id').values_list('id', 'question', 'answer',
+                                   'flashcard_set_id', 'flashcard_set__title',
+                                   'rank')
+    return [_result(*row) for row in cards[offset:offset + limit]]
+
+
+def _search_sqlite(user, query, limit, offset):
+    match = fts5_query(query)
+    if not match:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(SQLITE_SEARCH, [match, user.pk, limit, offset])
+        # bm25 is lower-is-better, flip it so every backend ranks upwards
+        return [_result(*row[:5], -row[5]) for row in cursor.fetchall()]
+
+
+def _search_fallback(user, query, limit, offset):
+    cards = Flashcard.objects.filter(flashcard_set__user=user).filter(
+        Q(question__icontains=query) | Q(answer__icontains=query)).order_by(
+        'id').values_list('id', 'question', 'answer', 'flashcard_set_id',
+                          'flashcard_set__title')
+    return [_result(*row, None) for row in cards[offset:offset + limit]]
+
+
+def search_cards(user, query: str, page: int = 1,
+                 page_size: int = SEARCH_PAGE_SIZE) -> Tuple[List[dict], bool]:
+    """One ranked page of the user's cards matching query, and has_next"""
+    query = query.strip()
+    if not query:
+        return [], False
+
+    search = {
+        'postgresql': _search_postgresql,
+        'sqlite': _search_sqlite,
+    }.get(connection.vendor, _search_fallback)
+
+    # Fetch one extra row to know whether another page exists
+    results = search(user, query, page_size + 1, (page - 1) * page_size)
+    return results[:page_size], len(results) > page_size
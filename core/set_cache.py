@@ -0,0 +1,37 @@
+import json
+from typing import List, Optional, Tuple
+from decouple import config
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+SET_CACHE_TIMEOUT = config("SET_CACHE_TIMEOUT", default=3600, cast=int)
+
+
+def _payload_key(set_id, etag) -> str:
+    return f"flashcard_set:{set_id}:payload:{etag}"
+
+
+def etag_for(set_id, updated_at) -> str:
+    version = int(updated_at.timestamp() * 1_000_000)
+    return f'"{set_id}-{version}"'
+
+
+def get_payload(set_id, etag) -> Optional[bytes]:
+    """The encoded JSON of one version of a set, if cached
+
+    Payloads are keyed by version, so a changed set is never served from
+    an older entry; those simply expire.
+    """
+    return cache.get(_payload_key(set_id, etag))
+
+
+def build_payload(set_id, etag, title: str,
+                  flashcards: List[Tuple[str, str]]) -> bytes:
+    """Serialize a set for load_flashcard_set and cache the encoded bytes"""
+    payload = json.dumps({
+        'success': True,
+        'flashcards': flashcards,
+        'set_title': title
+    }, cls=DjangoJSONEncoder).encode()
+    cache.set(_payload_key(set_id, etag), payload, SET_CACHE_TIMEOUT)
+    return payload
@@ -0,0 +1,54 @@
+from datetime import timedelta
+from typing import Dict, Tuple
+from django.db import transaction
+from django.utils import timezone
+from .models import CardReview
+
+MIN_EASE_FACTOR = 1.3
+
+
+def sm2(ease_factor: float, interval_days: int, repetitions: int,
+        grade: int) -> Tuple[float, int, int]:
+    """One SuperMemo-2 step, grade runs from 0 (blackout) to 5 (perfect)"""
+    if grade < 3:
+        repetitions = 0
+        interval_days = 1
+    else:
+        if repetitions == 0:
+            interval_days = 1
+        elif repetitions == 1:
+            interval_days = 6
+        else:
+            interval_days = round(interval_days * ease_factor)
+        repetitions += 1
+
+    ease_factor += 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02)
+    return max(MIN_EASE_FACTOR, ease_factor), interval_days, repetitions
+
+
+def due_reviews(user, limit, set_id=None):
+    """The user's next due cards, read straight off the (user, due_at) index"""
+    reviews = CardReview.objects.filter(
+        user=user, due_at__lte=timezone.now()).select_related('card')
+    if set_id is not None:
+        reviews = reviews.filter(card__flashcard_set_id=set_id)
+    return list(reviews.order_by('due_at')[:limit])
+
+
+def apply_reviews(user, grades: Dict[int, int]):
+    """Grade many cards at once: one read and one bulk update"""
+    now = timezone.now()
+    with transaction.atomic():
+        reviews = list(CardReview.objects.select_for_update().filter(
+            user=user, card_id__in=grades))
+        for review in reviews:
+            review.ease_factor, review.interval_days, review.repetitions = sm2(
+                review.ease_factor, review.interval_days, review.repetitions,
+                grades[review.card_id])
+            review.due_at = now + timedelta(days=review.interval_days)
+            review.last_reviewed_at = now
+
+        CardReview.objects.bulk_update(
+            reviews, ['ease_factor', 'interval_days', 'repetitions', 'due_at',
+                      'last_reviewed_at'])
+    return reviews
@@ -0,0 +1,211 @@
+import json
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+BART_PATH = "/models/facebook/bart-large-cnn"
+CHAT_PATH = "/api/v1/chat/completions"
+MODELS_PATH = "/api/v1/models"
+
+STUB_MODELS = ["stub/alpha:free", "stub/beta:free", "stub/gamma:free"]
+CARD_COUNT = re.compile(r"Create (\d+) question")
+TEXT_MARKER = "This is the text to base the questions on:"
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Cancelled callers hang up mid-response, which is not a stub error
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubUpstream:
+    """Local stand-in for the Hugging Face and OpenRouter endpoints
+
+    Serves BART summaries, chat completions (plain or streamed) and the
+    model catalog on 127.0.0.1. Each request waits `latency` seconds plus
+    up to `jitter`, fails with a 503 at `error_rate`, and at
+    `malformed_rate` answers in numbered Q:/A: lines instead of pipes. Faults
+    come from a seeded RNG so runs can be repeated.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0,
+                 malformed_rate=0.0, seed=0, port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        # Faults and card text draw from separate generators so the fault
+        # sequence does not depend on how concurrent requests interleave
+        self.rng = random.Random(seed)
+        self.text_rng = random.Random(seed + 1)
+        self.lock = threading.Lock()
+        self.counts = {"bart": 0, "chat": 0, "models": 0, "errors": 0,
+                       "malformed": 0}
+        self.server = _Server(("127.0.0.1", port), self._handler())
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def urls(self) -> dict:
+        """Settings that point the app at this stub"""
+        return {
+            "HF_API_URL": self.base_url + BART_PATH,
+            "OPENROUTER_CHAT_URL": self.base_url + CHAT_PATH,
+            "OPENROUTER_MODELS_URL": self.base_url + MODELS_PATH,
+        }
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name="stub-upstream", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _roll(self):
+        """Decide this request's delay and fault under the lock"""
+        with self.lock:
+            delay = self.latency + self.rng.uniform(0, self.jitter)
+            failed = self.rng.random() < self.error_rate
+            malformed = not failed and self.rng.random() < self.malformed_rate
+            if failed:
+                self.counts["errors"] += 1
+            if malformed:
+                self.counts["malformed"] += 1
+        return delay, failed, malformed
+
+    def _count(self, route):
+        with self.lock:
+            self.counts[route] += 1
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status, body, extra_headers=()):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in extra_headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def do_GET(self):
+                if self.path != MODELS_PATH:
+                    return self._json(404, {"error": "not found"})
+                stub._count("models")
+                self._json(200, {"data": [
+                    {"id": model, "pricing": {"prompt": "0",
+                                              "completion": "0"}}
+                    for model in STUB_MODELS]})
+
+            def do_POST(self):
+                body = self._body()
+                route = {BART_PATH: "bart", CHAT_PATH: "chat"}.get(self.path)
+                if route is None:
+                    return self._json(404, {"error": "not found"})
+                stub._count(route)
+
+                delay, failed, malformed = stub._roll()
+                time.sleep(delay)
+                if failed:
+                    return self._json(503, {"error": "stub outage"},
+                                      [("Retry-After", "0")])
+
+                if route == "bart":
+                    words = str(body.get("inputs", "")).split()
+                    return self._json(200, [{"summary_text": " ".join(
+                        words[:max(5, len(words) // 5)])}])
+
+                content = stub.completion(body, malformed)
+                if body.get("stream"):
+                    return self._stream(content)
+                self._json(200, {"choices": [
+                    {"message": {"role": "assistant", "content": content}}]})
+
+            def _stream(self, content):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.wfile.write(b": OPENROUTER PROCESSING\n\n")
+                for start in range(0, len(content), 16):
+                    event = {"choices": [
+                        {"delta": {"content": content[start:start + 16]}}]}
+                    self.wfile.write(
+                        f"data: {json.dumps(event)}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+        return Handler
+
+    def completion(self, body, malformed) -> str:
+        """Card text for the number the prompt asks for"""
+        prompt = body.get("messages", [{}])[-1].get("content", "")
+        match = CARD_COUNT.search(prompt)
+        number = int(match.group(1)) if match else 3
+        # Questions quote different words of the source text so the
+        # duplicate filter treats them as distinct, as it would real ones
+        words = prompt.rsplit(TEXT_MARKER, 1)[-1].split() or ["text"]
+        with self.lock:
+            topics = [" ".join(self.text_rng.choice(words) for _ in range(3))
+                      for _ in range(number)]
+        pairs = [(f"What does the text say about {topic}?",
+                  f"It explains {topic}.") for topic in topics]
+        if malformed:
+            return "\n".join(f"{i + 1}. Q: {question} A: {answer}"
+                             for i, (question, answer) in enumerate(pairs))
+        return "\n".join(f"|{question} $$ {answer}|"
+                         for question, answer in pairs)
+
+
+def use_stub(stub: StubUpstream) -> ExitStack:
+    """Point this process's upstream calls at a running stub
+
+    Also lifts the per-provider rate limits, which exist to protect the
+    real APIs and would otherwise dominate benchmark timings.
+    """
+    from . import async_utils, catalog, ratelimit, utils
+
+    urls = stub.urls
+    stack = ExitStack()
+    for module in (utils, async_utils):
+        stack.enter_context(mock.patch.multiple(
+            module, HUGGINGFACE_API_URL=urls["HF_API_URL"],
+            OPENROUTER_CHAT_URL=urls["OPENROUTER_CHAT_URL"]))
+    stack.enter_context(mock.patch.object(
+        catalog, "OPENROUTER_MODELS_URL", urls["OPENROUTER_MODELS_URL"]))
+    stack.enter_context(mock.patch.dict(ratelimit.RATE_LIMITS, {
+        provider: (10000.0, 10000) for provider in ratelimit.RATE_LIMITS}))
+    return stack
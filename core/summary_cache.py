@@ -0,0 +1,120 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+from decouple import config
+from . import metrics
+from .models import SummaryCacheEntry
+
+SUMMARY_CACHE_SIZE = config("SUMMARY_CACHE_SIZE", default=1024, cast=int)
+# "memory" keeps summaries in this process only, "db" also stores them in
+# the SummaryCacheEntry table so they survive restarts and are shared.
+SUMMARY_CACHE_BACKEND = config("SUMMARY_CACHE_BACKEND", default="memory")
+SUMMARY_CACHE_DB_MAX_ENTRIES = config("SUMMARY_CACHE_DB_MAX_ENTRIES",
+                                      default=50000, cast=int)
+PRUNE_EVERY = 100
+
+
+def summary_key(chunk: str, model_url: str) -> str:
+    """Content address of a chunk summarized by a given model"""
+    digest = hashlib.sha256()
+    digest.update(model_url.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(chunk.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SummaryCache:
+    """LRU cache of chunk summaries with an optional database backend"""
+
+    def __init__(self, max_size=SUMMARY_CACHE_SIZE,
+                 backend=SUMMARY_CACHE_BACKEND):
+        self.max_size = max_size
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, chunk: str, model_url: str) -> Optional[str]:
+        key = summary_key(chunk, model_url)
+
+        with self._lock:
+            summary = self._entries.get(key)
+            if summary is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.summary_cache_lookups.inc(result="hit")
+                return summary
+
+        if self.backend == "db":
+            summary = self._db_get(key)
+            if summary is not None:
+                self._remember(key, summary)
+                with self._lock:
+                    self.hits += 1
+                metrics.summary_cache_lookups.inc(result="hit")
+                return summary
+
+        with self._lock:
+            self.misses += 1
+        metrics.summary_cache_lookups.inc(result="miss")
+        return None
+
+    def set(self, chunk: str, model_url: str, summary: str):
+        key = summary_key(chunk, model_url)
+        self._remember(key, summary)
+        if self.backend == "db":
+            self._db_set(key, summary)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "backend": self.backend,
+            }
+
+    def _remember(self, key, summary):
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _db_get(self, key):
+        return SummaryCacheEntry.objects.filter(key=key).values_list(
+            'summary', flat=True).first()
+
+    def _db_set(self, key, summary):
+        SummaryCacheEntry.objects.update_or_create(
+            key=key, defaults={'summary': summary})
+
+        with self._lock:
+            self._writes += 1
+            should_prune = self._writes % PRUNE_EVERY == 0
+        if should_prune:
+            self._db_prune()
+
+    def _db_prune(self):
+        # Drop the oldest rows once the table grows past its bound
+        limit = SUMMARY_CACHE_DB_MAX_ENTRIES
+        cutoff = list(SummaryCacheEntry.objects.order_by(
+            '-created_at').values_list('created_at', flat=True)[limit:limit + 1])
+        if cutoff:
+            SummaryCacheEntry.objects.filter(
+                created_at__lte=cutoff[0]).delete()
+
+
+summary_cache = SummaryCache()
@@ -1,3 +1,1094 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+import warnings
+from datetime import timedelta
+from io import StringIO
+import httpx
+import requests
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from unittest import mock
+from accounts.models import CustomUser
+from . import (catalog, http, jobs, metrics, parsing, quotas, ratelimit,
+               scoreboard)
+from .jobs import claim_next, enqueue, job_to_dict, run_job
+from .models import CardReview, Flashcard, FlashcardSet, Job
+from .search import search_cards
+from .srs import MIN_EASE_FACTOR, sm2
+from .stubs import STUB_MODELS, StubUpstream, use_stub
+from .summary_cache import summary_cache
+from .async_utils import arequest_cards
+from .utils import (BART_ERROR, SUMMARY_MAX_WORKERS, CardStreamParser,
+                    create_cards, fits_one_window, generate_flashcards,
+                    map_reduce_summarize, plan_generation, stream_flashcards,
+                    summarize_chunks, summarize_text)
 
-# Create your tests here.
+
+def make_cards(count):
+    return [[f"Question {i}?", f"Answer {i}"] for i in range(count)]
+
+
+class SaveFlashcardSetTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='student@example.com', email='student@example.com',
+            password='password')
+        self.client.force_login(self.user)
+
+    @override_settings(FLASHCARD_BULK_BATCH_SIZE=140)
+    def test_save_costs_constant_queries(self):
+        # Set insert, one bulk insert for the cards and one for their review
+        # state, inside a savepoint. Sizes stay below SQLite's bound-parameter
+        # limit so the batches are not split further.
+        for count in (1, 50, 140):
+            with self.assertNumQueries(5):
+                FlashcardSet.objects.create_with_cards(
+                    self.user, f"Set of {count}", make_cards(count))
+
+        self.assertEqual(Flashcard.objects.count(), 191)
+
+    def test_core_view_saves_set(self):
+        response = self.client.post(reverse('core'), {
+            'save_flashcards': 'true',
+            'set_title': 'Biology',
+            'flashcards_data': json.dumps(make_cards(3)),
+        })
+
+        self.assertTrue(response.context['save_success'])
+        flashcard_set = FlashcardSet.objects.get(title='Biology')
+        self.assertEqual(flashcard_set.cards.count(), 3)
+
+    def test_core_view_rejects_malformed_cards(self):
+        response = self.client.post(reverse('core'), {
+            'save_flashcards': 'true',
+            'set_title': 'Broken',
+            'flashcards_data': json.dumps([["Only a question"]]),
+        })
+
+        self.assertFalse(response.context['save_success'])
+        self.assertFalse(FlashcardSet.objects.exists())
+
+    def test_api_saves_large_set(self):
+        response = self.client.post(
+            reverse('flashcard_sets_api'),
+            data=json.dumps({'title': 'Big', 'flashcards': make_cards(1200)}),
+            content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['count'], 1200)
+        self.assertEqual(
+            FlashcardSet.objects.get(title='Big').cards.count(), 1200)
+
+    def test_api_rejects_invalid_body(self):
+        response = self.client.post(
+            reverse('flashcard_sets_api'),
+            data=json.dumps({'title': 'Empty', 'flashcards': []}),
+            content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(FlashcardSet.objects.exists())
+
+
+class QueryBudgetTests(TestCase):
+    """Query counts for the busiest views must not grow with the data"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            username='student@example.com', email='student@example.com',
+            password='password')
+        self.client.force_login(self.user)
+
+    def make_sets(self, sets, cards):
+        return [FlashcardSet.objects.create_with_cards(
+            self.user, f"Set {i}", make_cards(cards)) for i in range(sets)]
+
+    def test_core_view(self):
+        # Session, user, and the sidebar page with its card counts
+        for sets in (1, 40):
+            self.make_sets(sets, 5)
+            with self.assertNumQueries(3):
+                self.client.get(reverse('core'))
+
+    def test_load_flashcard_set_page(self):
+        for cards in (1, 200):
+            flashcard_set = self.make_sets(1, cards)[0]
+            with self.assertNumQueries(5):
+                self.client.get(reverse('load_flashcard_set',
+                                        args=[flashcard_set.id]))
+
+    def test_load_flashcard_set_json_is_cached(self):
+        flashcard_set = self.make_sets(1, 200)[0]
+        url = reverse('load_flashcard_set', args=[flashcard_set.id])
+
+        with self.assertNumQueries(4):
+            self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        # Session, user and the set's version once the payload is cached
+        with self.assertNumQueries(3):
+            self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    def test_load_flashcard_set_json_revalidates(self):
+        flashcard_set = self.make_sets(1, 2)[0]
+        url = reverse('load_flashcard_set', args=[flashcard_set.id])
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+        etag = self.client.get(url, **ajax)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **ajax)
+        self.assertEqual(response.status_code, 304)
+
+        # Bulk edits skip Flashcard.save but still change the version
+        flashcard_set.cards.update(answer="Edited")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **ajax)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['flashcards'][0][1], "Edited")
+
+        FlashcardSet.objects.filter(id=flashcard_set.id).delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **ajax)
+        self.assertEqual(response.status_code, 404)
+
+    def test_delete_flashcard_set(self):
+        # Django deletes cascaded rows in batches of 100
+        for cards in (1, 100):
+            flashcard_set = self.make_sets(1, cards)[0]
+            with self.assertNumQueries(7):
+                self.client.post(reverse('delete_flashcard_set',
+                                         args=[flashcard_set.id]),
+                                 HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            self.assertFalse(
+                FlashcardSet.objects.filter(id=flashcard_set.id).exists())
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='student@example.com', email='student@example.com',
+            password='password')
+        self.client.force_login(self.user)
+        self.sets = [FlashcardSet.objects.create_with_cards(
+            self.user, f"Set {i}", make_cards(i + 1)) for i in range(5)]
+
+    def walk(self, limit):
+        pages, cursor = [], None
+        while True:
+            params = {'limit': limit, **({'cursor': cursor} if cursor else {})}
+            # Session, user and the page itself, however deep the page
+            with self.assertNumQueries(3):
+                data = self.client.get(reverse('flashcard_sets_api'),
+                                       params).json()
+            pages.append([(row['id'], row['card_count'])
+                          for row in data['sets']])
+            cursor = data['next_cursor']
+            if cursor is None:
+                return pages
+
+    def test_walks_every_set_once_newest_first(self):
+        other = CustomUser.objects.create_user(
+            username='other@example.com', email='other@example.com',
+            password='password')
+        FlashcardSet.objects.create_with_cards(other, "Theirs", make_cards(1))
+
+        pages = self.walk(2)
+        expected = [(s.id, i + 1) for i, s in enumerate(self.sets)][::-1]
+        self.assertEqual(pages, [expected[:2], expected[2:4], expected[4:]])
+
+    def test_ties_on_created_at_are_broken_by_id(self):
+        FlashcardSet.objects.update(created_at=timezone.now())
+
+        pages = self.walk(2)
+        self.assertEqual([set_id for page in pages for set_id, _ in page],
+                         sorted((s.id for s in self.sets), reverse=True))
+
+    def test_bad_cursor_or_limit(self):
+        url = reverse('flashcard_sets_api')
+        for params in ({'cursor': 'not-a-cursor'}, {'limit': 'ten'}):
+            self.assertEqual(self.client.get(url, params).status_code, 400)
+
+
+class SearchTests(TestCase):
+    """Full-text search over the SQLite FTS5 index"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='student@example.com', email='student@example.com',
+            password='password')
+        self.flashcard_set = FlashcardSet.objects.create_with_cards(
+            self.user, "Biology", [
+                ["What is the powerhouse of the cell?", "Mitochondria"],
+                ["Which cell organelle holds cell DNA in every cell?",
+                 "The nucleus"],
+                ["What do plants use for photosynthesis?", "Chloroplasts"],
+            ])
+
+    def search(self, query, **kwargs):
+        return search_cards(self.user, query, **kwargs)
+
+    def questions(self, query):
+        return [result["question"] for result in self.search(query)[0]]
+
+    def test_ranks_closer_matches_first(self):
+        results, has_next = self.search("cell")
+        self.assertEqual([result["question"] for result in results], [
+            "Which cell organelle holds cell DNA in every cell?",
+            "What is the powerhouse of the cell?"])
+        self.assertGreater(results[0]["rank"], results[1]["rank"])
+        self.assertEqual(results[0]["set_title"], "Biology")
+        self.assertFalse(has_next)
+
+    def test_only_searches_own_cards(self):
+        other = CustomUser.objects.create_user(
+            username='other@example.com', email='other@example.com',
+            password='password')
+        FlashcardSet.objects.create_with_cards(
+            other, "Theirs", [["What is a cell wall?", "Cellulose"]])
+
+        self.assertEqual(len(self.questions("cell")), 2)
+        self.assertEqual(self.questions("cellulose"), [])
+
+    def test_fts_syntax_is_quoted(self):
+        self.assertEqual(len(self.questions('cell") OR (')), 2)
+        self.assertEqual(self.questions('"*^:'), [])
+        # A bare "or" still means either word, as it does on PostgreSQL
+        self.assertEqual(len(self.questions("nucleus or chloroplasts")), 2)
+        self.assertEqual(self.questions("photo"),
+                         ["What do plants use for photosynthesis?"])
+
+    def test_pages(self):
+        FlashcardSet.objects.create_with_cards(
+            self.user, "More", [[f"Cell fact {i}?", "Yes"] for i in range(3)])
+
+        pages = [self.search("cell", page=page, page_size=2)
+                 for page in (1, 2, 3)]
+        self.assertEqual([(len(results), has_next)
+                          for results, has_next in pages],
+                         [(2, True), (2, True), (1, False)])
+        card_ids = {result["card_id"] for results, _ in pages
+                    for result in results}
+        self.assertEqual(len(card_ids), 5)
+
+    def test_index_follows_updates_and_deletes(self):
+        card = self.flashcard_set.cards.get(answer="Mitochondria")
+        card.answer = "Ribosome"
+        card.save()
+        self.assertEqual(self.questions("mitochondria"), [])
+        self.assertEqual(len(self.questions("ribosome")), 1)
+
+        self.flashcard_set.cards.filter(answer="The nucleus").update(
+            question="Where is DNA kept?")
+        self.assertEqual(self.questions("organelle"), [])
+        self.assertEqual(self.questions("DNA"), ["Where is DNA kept?"])
+
+        self.flashcard_set.cards.filter(answer="Ribosome").delete()
+        self.assertEqual(self.questions("ribosome"), [])
+        self.assertEqual(self.questions("cell"), [])
+
+
+class SpacedRepetitionTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='student@example.com', email='student@example.com',
+            password='password')
+        self.client.force_login(self.user)
+        self.biology = FlashcardSet.objects.create_with_cards(
+            self.user, "Biology", make_cards(3))
+        self.history = FlashcardSet.objects.create_with_cards(
+            self.user, "History", make_cards(2))
+
+    def review(self, card):
+        return CardReview.objects.get(user=self.user, card=card)
+
+    def test_sm2_intervals(self):
+        state = (2.5, 0, 0)
+        steps = []
+        for grade in (5, 5, 4, 2):
+            state = sm2(*state, grade)
+            steps.append(state[1:])
+        # 1 day, 6 days, then the previous interval times the ease factor,
+        # until a failed recall starts over
+        self.assertEqual(steps, [(1, 1), (6, 2), (16, 3), (1, 0)])
+        self.assertAlmostEqual(state[0], 2.38)
+
+    def test_sm2_ease_floor(self):
+        ease_factor, interval_days, repetitions = sm2(1.4, 10, 4, 0)
+        self.assertEqual(ease_factor, MIN_EASE_FACTOR)
+        self.assertEqual((interval_days, repetitions), (1, 0))
+
+    def test_due_queue(self):
+        cards = list(Flashcard.objects.order_by('id'))
+        now = timezone.now()
+        for offset, card in enumerate(cards):
+            CardReview.objects.filter(card=card).update(
+                due_at=now - timedelta(minutes=offset))
+        CardReview.objects.filter(card=cards[0]).update(
+            due_at=now + timedelta(days=1))
+
+        response = self.client.get(reverse('due_cards'), {'limit': 3})
+        # Most overdue first, cards that are not due yet left out
+        self.assertEqual([card['card_id'] for card in
+                          response.json()['cards']],
+                         [cards[4].id, cards[3].id, cards[2].id])
+
+        response = self.client.get(reverse('due_cards'),
+                                   {'set': self.biology.id})
+        self.assertEqual([card['card_id'] for card in
+                          response.json()['cards']],
+                         [cards[2].id, cards[1].id])
+
+        response = self.client.get(reverse('due_cards'), {'set': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_submit_reviews_in_one_batch(self):
+        url = reverse('submit_reviews')
+        # Session, user, one locking read and one bulk update in a savepoint
+        for cards in (self.history.cards.all(), Flashcard.objects.all()):
+            body = json.dumps({'reviews': [
+                {'card_id': card.id, 'grade': 4} for card in cards]})
+            with self.assertNumQueries(6):
+                response = self.client.post(url, body,
+                                            content_type='application/json')
+            self.assertEqual(response.json()['updated'], len(cards))
+
+        card = self.history.cards.first()
+        review = self.review(card)
+        self.assertEqual((review.interval_days, review.repetitions), (6, 2))
+        self.assertGreater(review.due_at, timezone.now() + timedelta(days=5))
+
+    def test_submit_reviews_rejects_bad_grades_and_other_users_cards(self):
+        url = reverse('submit_reviews')
+        card = self.history.cards.first()
+        response = self.client.post(url, json.dumps({'reviews': [
+            {'card_id': card.id, 'grade': 6}]}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.review(card).repetitions, 0)
+
+        other = CustomUser.objects.create_user(
+            username='other@example.com', email='other@example.com',
+            password='password')
+        self.client.force_login(other)
+        response = self.client.post(url, json.dumps({'reviews': [
+            {'card_id': card.id, 'grade': 5}]}),
+            content_type='application/json')
+        self.assertEqual(response.json()['updated'], 0)
+        self.assertEqual(self.review(card).repetitions, 0)
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_busy_lock_is_left_to_its_holder(self):
+        cache.add("bucket:lock", True, 60)
+        with ratelimit.cache_lock("bucket", timeout=0.05) as locked:
+            self.assertFalse(locked)
+
+        self.assertTrue(cache.get("bucket:lock"))
+
+    @mock.patch.dict(ratelimit.RATE_LIMITS, {'openrouter': (0.001, 0)})
+    @mock.patch('core.utils.LOCAL_CARD_FALLBACK', False)
+    def test_local_throttling_is_not_blamed_on_the_model(self):
+        self.assertIsNone(async_to_sync(arequest_cards)("some/model",
+                                                        "prompt", 3))
+        self.assertEqual(list(stream_flashcards("text", 3, ["some/model"])),
+                         [])
+        stats = scoreboard.get_stats(["some/model"])["some/model"]
+        self.assertEqual(stats["attempts"], 0)
+
+
+class QuotaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            username='student@example.com', email='student@example.com',
+            password='password')
+        self.factory = RequestFactory()
+
+    def call(self, view):
+        request = self.factory.post('/')
+        request.user = self.user
+        return view(request)
+
+    def test_over_quota_gets_429_with_retry_after(self):
+        view = quotas.user_quota('test', limit=2, window=60)(
+            lambda request: HttpResponse())
+
+        self.assertEqual([self.call(view).status_code for _ in range(3)],
+                         [200, 200, 429])
+        self.assertEqual(self.call(view)['Retry-After'], '30')
+
+    def test_failed_requests_are_not_counted(self):
+        view = quotas.user_quota('test', limit=1, window=60)(
+            lambda request: HttpResponse(status=502))
+
+        for _ in range(3):
+            self.assertEqual(self.call(view).status_code, 502)
+
+    def test_window_slides_over_the_previous_one(self):
+        cache.set(f"quota:test:{self.user.id}:9", 10)
+        cache.set(f"quota:test:{self.user.id}:10", 2)
+
+        # A quarter into window 10, three quarters of window 9 still count
+        self.assertEqual(quotas.window_count('test', self.user.id, 60,
+                                             now=615), 9.5)
+        self.assertEqual(quotas.window_count('test', self.user.id, 60,
+                                             now=600), 12)
+
+    def test_stream_keeps_its_slot_until_closed(self):
+        view = quotas.user_quota('test', limit=0, concurrency=1)(
+            lambda request: StreamingHttpResponse(iter([b"data"])))
+
+        stream = self.call(view)
+        self.assertEqual(self.call(view).status_code, 429)
+        # Closed before the first chunk, as when the client hangs up
+        stream.close()
+        self.assertEqual(self.call(view).status_code, 200)
+
+
+class JobTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            username='student@example.com', email='student@example.com',
+            password='password')
+
+    def work(self, **options):
+        call_command('run_jobs', once=True, stdout=StringIO(), **options)
+
+    def test_enqueue_rejects_unknown_kinds(self):
+        with self.assertRaises(ValueError):
+            enqueue(self.user, "translate", text="Hola")
+
+    def test_claims_oldest_pending_job_once(self):
+        first = enqueue(self.user, Job.SUMMARIZE, text="First")
+        second = enqueue(self.user, Job.SUMMARIZE, text="Second")
+
+        self.assertEqual(claim_next(), first)
+        self.assertEqual(claim_next(), second)
+        self.assertIsNone(claim_next())
+        first.refresh_from_db()
+        self.assertEqual(first.status, Job.RUNNING)
+        self.assertIsNotNone(first.started_at)
+
+    def test_run_job_stores_result_or_failure(self):
+        enqueue(self.user, Job.SUMMARIZE, text="Cells divide. " * 20)
+        with StubUpstream() as stub, use_stub(stub):
+            job = run_job(claim_next())
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.progress, 100)
+        self.assertIn("Cells divide.", job.result["summary"])
+
+        async def broken(job):
+            raise RuntimeError("upstream exploded")
+
+        enqueue(self.user, Job.SUMMARIZE, text="Cells divide.")
+        with mock.patch.dict(jobs.HANDLERS, {Job.SUMMARIZE: broken}):
+            job = run_job(claim_next())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("upstream exploded", job.error)
+        # The traceback stays server side
+        self.assertEqual(job_to_dict(job)["error"], "Job failed.")
+
+    @mock.patch('core.jobs.JOB_TIMEOUT', 0.1)
+    def test_overlong_jobs_are_cancelled(self):
+        async def stuck(job):
+            await asyncio.sleep(10)
+
+        enqueue(self.user, Job.SUMMARIZE, text="Cells divide.")
+        with mock.patch.dict(jobs.HANDLERS, {Job.SUMMARIZE: stuck}):
+            job = run_job(claim_next())
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("TimeoutError", job.error)
+
+    def test_stale_jobs_are_requeued_and_run(self):
+        stale = enqueue(self.user, Job.SUMMARIZE, text="Cells divide. " * 20)
+        live = enqueue(self.user, Job.SUMMARIZE, text="Cells grow. " * 20)
+        Job.objects.filter(id=stale.id).update(
+            status=Job.RUNNING, started_at=timezone.now() -
+            timedelta(seconds=jobs.JOB_STALE_AFTER + 1))
+        Job.objects.filter(id=live.id).update(status=Job.RUNNING,
+                                              started_at=timezone.now())
+
+        with StubUpstream() as stub, use_stub(stub):
+            self.work()
+
+        stale.refresh_from_db()
+        live.refresh_from_db()
+        self.assertEqual(stale.status, Job.SUCCEEDED)
+        self.assertEqual(live.status, Job.RUNNING)
+
+    def test_worker_runs_jobs_side_by_side(self):
+        for topic in ("Ribosomes", "Lysosomes", "Vacuoles"):
+            enqueue(self.user, Job.SUMMARIZE, text=f"{topic} matter. " * 50)
+
+        with StubUpstream(latency=1.0) as stub, use_stub(stub):
+            started = time.monotonic()
+            self.work(concurrency=3)
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(stub.counts["bart"], 3)
+        self.assertLess(elapsed, 2.5)
+        self.assertEqual(Job.objects.filter(status=Job.SUCCEEDED).count(), 3)
+
+    def test_bad_card_counts_are_rejected_before_queueing(self):
+        self.client.force_login(self.user)
+        for mode in ("llm", "instant"):
+            for num_cards in ("x", "0", "9"):
+                response = self.client.post(reverse('core'), {
+                    'text_content': 'Cells divide.', 'num_cards': num_cards,
+                    'generate_flashcard': mode},
+                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+                self.assertEqual(response.status_code, 400)
+
+        self.assertFalse(Job.objects.exists())
+        # Refused requests give their quota back
+        self.assertEqual(quotas.window_count('generation', self.user.id,
+                                             quotas.GENERATION_QUOTA_WINDOW),
+                         0)
+
+    def test_job_status_is_private(self):
+        job = enqueue(self.user, Job.SUMMARIZE, text="Cells divide.")
+        url = reverse('job_status', args=[job.id])
+
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(response.json()['job']['status'], Job.PENDING)
+
+        other = CustomUser.objects.create_user(
+            username='other@example.com', email='other@example.com',
+            password='password')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class EventLoopTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_short_lived_loop_closes_its_client(self):
+        async def client():
+            return http.async_session()
+
+        self.assertTrue(async_to_sync(client)().is_closed)
+
+    def test_worker_keeps_its_client_across_jobs(self):
+        user = CustomUser.objects.create_user(
+            username='student@example.com', email='student@example.com',
+            password='password')
+        for topic in ("Ribosomes", "Lysosomes"):
+            enqueue(user, Job.SUMMARIZE, text=f"{topic} matter. " * 300)
+
+        with StubUpstream() as stub, use_stub(stub), mock.patch(
+                'core.http.httpx.AsyncClient',
+                wraps=httpx.AsyncClient) as client:
+            call_command('run_jobs', once=True, stdout=StringIO())
+
+        self.assertEqual(stub.counts["bart"], 4)
+        self.assertEqual(client.call_count, 1)
+        self.assertEqual(Job.objects.filter(status=Job.SUCCEEDED).count(), 2)
+
+    def test_throttled_acquire_leaves_the_loop_free(self):
+        lock_key = ratelimit._bucket_key('openrouter', '') + ":lock"
+        cache.add(lock_key, True, 60)
+
+        async def scenario():
+            acquiring = asyncio.ensure_future(ratelimit.aacquire('openrouter'))
+            started = time.monotonic()
+            await asyncio.sleep(0.05)
+            paused = time.monotonic() - started
+            cache.delete(lock_key)
+            await acquiring
+            return paused
+
+        self.assertLess(async_to_sync(scenario)(), 0.5)
+
+
+class CatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_cold_fetch_is_cached(self):
+        with StubUpstream() as stub, use_stub(stub):
+            self.assertEqual(catalog.get_free_models(), STUB_MODELS)
+            self.assertEqual(catalog.get_free_models(), STUB_MODELS)
+
+        self.assertEqual(stub.counts["models"], 1)
+        self.assertLess(catalog.catalog_age(), 5)
+
+    @mock.patch('core.catalog.fetch_free_models',
+                side_effect=requests.ConnectionError("unreachable"))
+    def test_failed_cold_fetch_serves_fallback_for_a_while(self, fetch):
+        for _ in range(3):
+            self.assertEqual(catalog.get_free_models(),
+                             catalog.FALLBACK_MODELS)
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertIsNone(catalog.catalog_age())
+
+    def test_concurrent_cold_requests_do_not_all_fetch(self):
+        cache.add(catalog.CATALOG_LOCK_KEY, True, 60)
+        with StubUpstream() as stub, use_stub(stub):
+            self.assertEqual(catalog.get_free_models(),
+                             catalog.FALLBACK_MODELS)
+
+        self.assertEqual(stub.counts["models"], 0)
+
+
+class ScoreboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_ranks_by_expected_time_to_a_valid_result(self):
+        for _ in range(4):
+            scoreboard.record("fast/flaky", scoreboard.SUCCESS, 1.0)
+            scoreboard.record("fast/flaky", scoreboard.PARSE_FAILURE, 1.0)
+            scoreboard.record("slow/steady", scoreboard.SUCCESS, 4.0)
+
+        # 1s at 50% beats 4s every time, and beats the 15s guess for unseen
+        self.assertEqual(scoreboard.rank_models(
+            ["new/model", "slow/steady", "fast/flaky"]),
+            ["fast/flaky", "slow/steady", "new/model"])
+
+    def test_breaker_opens_and_closes(self):
+        for _ in range(scoreboard.BREAKER_THRESHOLD):
+            scoreboard.record("broken/model", scoreboard.ERROR, 1.0)
+        self.assertEqual(scoreboard.rank_models(["broken/model", "new/model"]),
+                         ["new/model"])
+        # With every circuit open, callers still get something to try
+        self.assertEqual(scoreboard.rank_models(["broken/model"]),
+                         ["broken/model"])
+
+        with mock.patch('core.scoreboard.time.time',
+                        return_value=time.time() +
+                        scoreboard.BREAKER_COOLDOWN + 1):
+            self.assertIn("broken/model",
+                          scoreboard.rank_models(["broken/model",
+                                                  "new/model"]))
+
+        scoreboard.record("broken/model", scoreboard.SUCCESS, 1.0)
+        stats = scoreboard.get_stats(["broken/model"])["broken/model"]
+        self.assertFalse(scoreboard.is_open(stats))
+        self.assertEqual(stats["consecutive_failures"], 0)
+
+    def test_concurrent_records_are_not_lost(self):
+        def record_many():
+            for _ in range(25):
+                scoreboard.record("busy/model", scoreboard.ERROR, 1.0)
+
+        threads = [threading.Thread(target=record_many) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = scoreboard.get_stats(["busy/model"])["busy/model"]
+        self.assertEqual(stats["attempts"], 200)
+        self.assertEqual(stats["consecutive_failures"], 200)
+
+
+class StreamViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            username='student@example.com', email='student@example.com',
+            password='password')
+
+    async def test_cards_are_sent_as_they_arrive(self):
+        second_card = threading.Event()
+
+        def stream_flashcards(text, number, known_questions=()):
+            yield ("What is ATP?", "Energy currency")
+            second_card.wait(5)
+            yield ("What is NADPH?", "An electron carrier")
+
+        await self.async_client.aforce_login(self.user)
+        with mock.patch('core.views.stream_flashcards', stream_flashcards), \
+                warnings.catch_warnings():
+            # Django warns when it has to buffer a sync iterator for ASGI
+            warnings.simplefilter('error')
+            response = await self.async_client.post(
+                reverse('stream_flashcards'),
+                {'text_content': 'Cells make ATP.', 'num_cards': 2})
+            chunks = aiter(response.streaming_content)
+            started = time.monotonic()
+            first = await anext(chunks)
+            waited = time.monotonic() - started
+            second_card.set()
+            rest = [chunk async for chunk in chunks]
+
+        self.assertLess(waited, 2)
+        self.assertIn(b'"What is ATP?"', first)
+        self.assertIn(b'"What is NADPH?"', rest[0])
+        self.assertEqual(rest[-1], b'event: done\ndata: {"count": 2}\n\n')
+        # The finished stream gave its concurrency slot back
+        self.assertEqual(cache.get(f"concurrency:generation:{self.user.id}"),
+                         0)
+
+
+class HedgingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cancelled = []
+
+    async def request_cards(self, model, prompt, number):
+        try:
+            if model == "slow/model":
+                await asyncio.sleep(30)
+            if model == "broken/model":
+                return None
+            await asyncio.sleep(0.05)
+            return [(f"Question from {model}?", "Answer")]
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+
+    def race(self, models, hedge_delay):
+        started = time.monotonic()
+        with mock.patch('core.async_utils.arequest_cards', self.request_cards):
+            cards = create_cards("text", 1, models, [],
+                                 hedge_delay=hedge_delay)
+        return cards, time.monotonic() - started
+
+    def test_slow_model_is_hedged_and_cancelled(self):
+        cards, elapsed = self.race(["slow/model", "fast/model"], 0.1)
+
+        self.assertEqual(cards, [("Question from fast/model?", "Answer")])
+        self.assertLess(elapsed, 1)
+        self.assertEqual(self.cancelled, ["slow/model"])
+
+    def test_failed_model_is_replaced_without_waiting(self):
+        cards, elapsed = self.race(["broken/model", "fast/model"], 10)
+
+        self.assertEqual(cards, [("Question from fast/model?", "Answer")])
+        self.assertLess(elapsed, 1)
+
+
+class StubUpstreamTests(TestCase):
+    """Summarization and generation against the local API stand-ins"""
+    # Ten chunks, each a paragraph led by its own topic
+    LONG_TEXT = "\n\n".join(
+        f"Topic{i} matters. " + "Cells divide often. " * 200
+        for i in range(10))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_summarize_text(self):
+        with StubUpstream() as stub, use_stub(stub):
+            summary = summarize_text("A sentence about cells. " * 300)
+
+        self.assertNotEqual(summary, BART_ERROR)
+        self.assertEqual(stub.counts["bart"], 2)
+
+    def test_long_document_is_reduced_not_truncated(self):
+        with StubUpstream() as stub, use_stub(stub):
+            summary = summarize_text(self.LONG_TEXT)
+
+        # Ten chunk summaries, then three groups of up to four of them
+        self.assertEqual(stub.counts["bart"], 10 + 3)
+        self.assertTrue(fits_one_window(summary))
+        self.assertIn("Topic8", summary)
+
+    def test_map_reduce_stops_at_max_depth(self):
+        with StubUpstream() as stub, use_stub(stub):
+            summary = map_reduce_summarize(self.LONG_TEXT, max_depth=1)
+
+        self.assertEqual(stub.counts["bart"], 10)
+        self.assertEqual(len(summary.split("\n\n")), 10)
+        self.assertIn("Topic9", summary)
+
+    def test_summary_cache_hits_are_reported(self):
+        staff = CustomUser.objects.create_user(
+            username='staff@example.com', email='staff@example.com',
+            password='password', is_staff=True)
+        self.client.force_login(staff)
+        summary_cache.clear()
+        with StubUpstream() as stub, use_stub(stub):
+            for _ in range(2):
+                summarize_text("Cilia move fluid over cells. " * 30)
+            status = self.client.get(reverse('model_status')).json()
+
+        self.assertEqual(stub.counts["bart"], 1)
+        self.assertEqual(status['summary_cache']['hits'], 1)
+        self.assertEqual(status['summary_cache']['misses'], 1)
+        self.assertIn('flashstudy_summary_cache_lookups_total{result="hit"}',
+                      metrics.render())
+
+    def test_fast_summary_makes_no_api_calls(self):
+        text = ("Enzymes speed up reactions in cells. " * 5 +
+                "Enzymes lower the activation energy of reactions. "
+                "The museum opens at nine.")
+        with StubUpstream() as stub, use_stub(stub):
+            summary = summarize_text(text, mode="fast")
+
+        self.assertIn("activation energy", summary)
+        self.assertNotIn("museum", summary)
+        self.assertEqual(stub.counts["bart"], 0)
+
+    def test_summary_falls_back_when_bart_fails(self):
+        with StubUpstream(error_rate=1.0) as stub, use_stub(stub):
+            summary = summarize_text("Ribosomes build proteins. " * 100)
+
+        self.assertNotEqual(summary, BART_ERROR)
+        self.assertIn("Ribosomes build proteins.", summary)
+
+    def test_summary_falls_back_past_latency_budget(self):
+        with StubUpstream(latency=2.0) as stub, use_stub(stub):
+            started = time.monotonic()
+            summaries = summarize_chunks(["Vacuoles store water. " * 20],
+                                         budget=0.2)
+
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertEqual(len(summaries), 1)
+        self.assertIn("Vacuoles store water.", summaries[0])
+
+    def test_summary_budget_cancels_queued_chunks(self):
+        chunks = [f"Chunk {i} is about mitochondria. " * 5 for i in range(30)]
+        with StubUpstream(latency=0.5) as stub, use_stub(stub):
+            summaries = summarize_chunks(chunks, budget=0.2)
+            # Let the calls already in flight finish
+            time.sleep(1.2)
+
+        self.assertEqual(len(summaries), 30)
+        self.assertLessEqual(stub.counts["bart"], SUMMARY_MAX_WORKERS)
+
+    def test_generate_flashcards_survives_faults(self):
+        with StubUpstream(error_rate=0.2, malformed_rate=0.3, seed=1) as stub, \
+                use_stub(stub):
+            cards = generate_flashcards(
+                " ".join(f"Organelle{i} makes protein{i}." for i in range(400)),
+                6)
+
+        self.assertEqual(len(cards), 6)
+        self.assertEqual(len({question for question, _ in cards}), 6)
+        self.assertGreater(stub.counts["errors"] + stub.counts["malformed"],
+                           0)
+
+    @mock.patch('core.utils.LOCAL_CARD_FALLBACK', False)
+    def test_off_format_completions_are_salvaged(self):
+        with StubUpstream(malformed_rate=1.0) as stub, use_stub(stub):
+            cards = generate_flashcards("Golgi bodies package proteins. " * 50,
+                                        4)
+            streamed = list(stream_flashcards(
+                "Lysosomes digest waste. " * 50, 3))
+
+        self.assertEqual(len(cards), 4)
+        self.assertEqual(len(streamed), 3)
+        self.assertGreater(stub.counts["malformed"], 0)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='student@example.com', email='student@example.com',
+            password='password')
+
+    def register(self, metric):
+        self.addCleanup(metrics._registry.remove, metric)
+        return metric
+
+    def test_exposition_format(self):
+        counter = self.register(metrics.Counter(
+            "test_total", "Test counter", ("name",)))
+        histogram = self.register(metrics.Histogram(
+            "test_seconds", "Test histogram", ("view",), (0.1, 1.0)))
+        counter.inc(name='say "hi"\n')
+        for value in (0.25, 0.5, 4):
+            histogram.observe(value, view="a")
+
+        text = metrics.render()
+        self.assertIn('# HELP test_total Test counter\n'
+                      '# TYPE test_total counter\n'
+                      'test_total{name="say \\"hi\\"\\n"} 1\n', text)
+        self.assertIn('# TYPE test_seconds histogram\n'
+                      'test_seconds_bucket{view="a",le="0.1"} 0\n'
+                      'test_seconds_bucket{view="a",le="1.0"} 2\n'
+                      'test_seconds_bucket{view="a",le="+Inf"} 3\n'
+                      'test_seconds_sum{view="a"} 4.75\n'
+                      'test_seconds_count{view="a"} 3\n', text)
+
+    def test_staff_only_without_token(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"# TYPE flashstudy_request_duration_seconds",
+                      response.content)
+
+    @mock.patch('core.views.METRICS_TOKEN', 'secret')
+    def test_bearer_token(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        # With a token configured, a staff session alone is not enough
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong'
+        ).status_code, 403)
+        self.assertEqual(self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret'
+        ).status_code, 200)
+
+    def core_queries(self):
+        series = metrics.request_queries.values.get(
+            ('core',), [0] * (len(metrics.QUERY_BUCKETS) + 2))
+        # Requests in the 5-query bucket, and queries summed
+        return series[metrics.QUERY_BUCKETS.index(5)], series[-1]
+
+    def test_middleware_counts_queries(self):
+        self.client.force_login(self.user)
+        served_before, queries_before = self.core_queries()
+
+        self.client.get(reverse('core'))
+
+        served, queries = self.core_queries()
+        self.assertEqual((served - served_before, queries - queries_before),
+                         (1, 3))
+
+    async def test_middleware_counts_queries_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        served_before, queries_before = self.core_queries()
+
+        await self.async_client.get(reverse('core'))
+
+        served, queries = self.core_queries()
+        self.assertEqual((served - served_before, queries - queries_before),
+                         (1, 3))
+
+
+class ParsingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_formats(self):
+        for content, expected_format in (
+                ("|What is ATP? $$ Energy currency|", parsing.PIPES),
+                ("1. What is ATP? $$ Energy currency", parsing.LINES),
+                ("**Q1:** What is ATP?\n**A1:** Energy currency", parsing.QA),
+                ("1. What is ATP? - Energy currency", parsing.NUMBERED)):
+            self.assertEqual(parsing.parse_pairs(content),
+                             ([("What is ATP?", "Energy currency")],
+                              expected_format))
+
+    def test_partial_completion_is_kept(self):
+        content = ("|What is ATP? $$ Energy currency|\n"
+                   "|What is NADPH? $$ An electron carrier|\n"
+                   "|What is the Calvin cycle? $$ Carbon fix")
+
+        self.assertEqual(len(parsing.parse_completion(content, 5)), 2)
+        self.assertEqual(parsing.parse_completion("Sorry, I can't.", 5), [])
+
+    def test_stream_parser_waits_for_closing_pipe(self):
+        parser = CardStreamParser()
+        chunks = ["Sure!\n|What is A", "TP? $$ Energy", " currency|\n|Wh",
+                  "at is NADPH? $$ An electron carrier|", "\n|Bad pair|",
+                  "\n|What is the Calvin cycle? $$ Carbon fix"]
+
+        self.assertEqual([parser.feed(chunk) for chunk in chunks], [
+            [], [], [("What is ATP?", "Energy currency")],
+            [("What is NADPH?", "An electron carrier")], [], []])
+        self.assertEqual(parser.feed("ation|"),
+                         [("What is the Calvin cycle?", "Carbon fixation")])
+
+    @mock.patch('core.utils.scoreboard.rank_models', lambda models: models)
+    @mock.patch('core.utils.LOCAL_CARD_FALLBACK', False)
+    def test_stream_asks_the_next_model_for_missing_cards(self):
+        prompts = []
+
+        def stream_completion(model, prompt):
+            prompts.append(prompt)
+            yield "|What is ATP? $$ Energy currency|\n|What is NA"
+            if model == "first":
+                raise ConnectionError("dropped")
+            yield "DPH? $$ An electron carrier|"
+
+        with mock.patch('core.utils._stream_completion', stream_completion):
+            cards = list(stream_flashcards("Cells make ATP.", 2,
+                                           ["first", "second"]))
+
+        # The second model is asked for one card, and its repeat is skipped
+        self.assertIn("Create 1 question", prompts[1])
+        self.assertIn("What is ATP?", prompts[1])
+        self.assertEqual(cards, [("What is ATP?", "Energy currency"),
+                                 ("What is NADPH?", "An electron carrier")])
+        self.assertEqual(
+            scoreboard.get_stats(["first"])["first"]["failures"], 1)
+
+
+class PlanGenerationTests(TestCase):
+    @staticmethod
+    def document(paragraph_words):
+        return "\n\n".join(
+            f"Topic{i} matters. " + "Cells divide often. " * (words // 3)
+            for i, words in enumerate(paragraph_words))
+
+    def test_short_text_is_one_request(self):
+        text = "Cells divide often. " * 30
+        self.assertEqual(plan_generation(text, 4), [(text, 4)])
+
+    def test_long_text_is_sampled_evenly(self):
+        plan = plan_generation(self.document([600] * 12), 4)
+
+        self.assertEqual([part.split()[0] for part, _ in plan],
+                         ["Topic0", "Topic3", "Topic6", "Topic9"])
+        self.assertEqual([count for _, count in plan], [1, 1, 1, 1])
+
+    def test_cards_are_shared_by_word_count(self):
+        for paragraph_words, number in (([120, 120, 120, 120, 360], 5),
+                                        ([150, 150, 450], 4),
+                                        ([900, 300, 600], 6),
+                                        ([300] * 8, 3)):
+            plan = plan_generation(self.document(paragraph_words), number)
+            sizes = [len(part.split()) for part, _ in plan]
+            counts = [count for _, count in plan]
+
+            self.assertGreater(len(plan), 1)
+            self.assertLessEqual(len(plan), number)
+            self.assertEqual(sum(counts), number)
+            # Largest remainders never stray a whole card from the exact share
+            for size, count in zip(sizes, counts):
+                self.assertLess(abs(count - number * size / sum(sizes)), 1)
+
+
+class LocalFlashcardTests(TestCase):
+    TEXT = (
+        "Photosynthesis is the process by which plants turn light into "
+        "chemical energy. Chlorophyll in the chloroplasts absorbs light for "
+        "photosynthesis. The Calvin cycle uses ATP and NADPH to fix carbon "
+        "dioxide into sugar. Plants store the sugar from photosynthesis as "
+        "starch in their roots. Stomata are small pores that let carbon "
+        "dioxide enter the leaf.")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_instant_mode_builds_cloze_and_definition_cards(self):
+        with StubUpstream() as stub, use_stub(stub):
+            cards = generate_flashcards(self.TEXT, 4, mode="instant")
+
+        self.assertEqual(len(cards), 4)
+        self.assertIn(("What is Photosynthesis?",
+                       "The process by which plants turn light into chemical "
+                       "energy."), cards)
+        for question, answer in cards:
+            if question.startswith("Fill in the blank"):
+                self.assertIn("_____", question)
+                self.assertNotIn("_____", answer)
+        self.assertEqual(stub.counts["chat"], 0)
+
+    def test_local_cards_replace_failed_models(self):
+        with StubUpstream(error_rate=1.0) as stub, use_stub(stub):
+            cards = list(stream_flashcards(self.TEXT, 3))
+
+        self.assertEqual(len(cards), 3)
+        self.assertGreater(stub.counts["errors"], 0)
@@ -5,4 +5,14 @@ urlpatterns = [
     path('', views.core_view, name='core'),
     path('load-set/<int:set_id>/', views.load_flashcard_set, name='load_flashcard_set'),
     path('delete-set/<int:set_id>/', views.delete_flashcard_set, name='delete_flashcard_set'),
+    path('stream-cards/', views.stream_flashcard_generation, name='stream_flashcards'),
+    path('jobs/<int:job_id>/', views.job_status, name='job_status'),
+    path('api/summarize/', views.summarize_api, name='summarize_api'),
+    path('api/generate/', views.generate_api, name='generate_api'),
+    path('api/sets/', views.flashcard_sets_api, name='flashcard_sets_api'),
+    path('api/search/', views.search_flashcards, name='search_flashcards'),
+    path('study/due/', views.due_cards, name='due_cards'),
+    path('study/reviews/', views.submit_reviews, name='submit_reviews'),
+    path('models/status/', views.model_status, name='model_status'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,9 +1,18 @@
-import requests
+import json
+import re
 import time
-from typing import List, Tuple, Optional
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Tuple, Optional
+from asgiref.sync import async_to_sync
 from decouple import config
-
-HUGGINGFACE_API_URL = "https://api-inference.huggingface.co/models/facebook/bart-large-cnn"
+from . import cloze, extractive, parsing, scoreboard
+from .catalog import get_free_models
+from .dedupe import DuplicateIndex
+from .ratelimit import RateLimitExceeded, acquire, request_with_backoff
+
+HUGGINGFACE_API_URL = config(
+    "HF_API_URL",
+    default="https://api-inference.huggingface.co/models/facebook/bart-large-cnn")
 HUGGINGFACE_API_TOKEN = config("HF_API")
 OR_API = config("OR_API")
 
@@ -15,104 +24,173 @@ MAX_WORDS_PER_CHUNK = 700
 MAX_CHARS_PER_CHUNK = 4530
 MAX_CHUNKS = 3
 
-
-def split_chunk_safely(text):
-    words = text.split()
-    mid = len(words) // 2
-    return [' '.join(words[:mid]), ' '.join(words[mid:])]
+# A paragraph break closes the chunk once it is this full
+PARAGRAPH_FILL = 0.8
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+SENTENCE_BREAK = re.compile(r'(?:(?<=[.!?])|(?<=[.!?]["\')\]]))\s+')
+
+OPENROUTER_CHAT_URL = config(
+    "OPENROUTER_CHAT_URL",
+    default="https://openrouter.ai/api/v1/chat/completions")
+
+BART_TIMEOUT = config("BART_TIMEOUT", default=30, cast=int)
+BART_ERROR = "Error: API call failed."
+# Concurrent BART and OpenRouter calls per event loop, so concurrent
+# requests cannot fan out into an unbounded number of upstream calls
+SUMMARY_MAX_WORKERS = config("SUMMARY_MAX_WORKERS", default=MAX_CHUNKS,
+                             cast=int)
+
+# Race slow models: after HEDGE_DELAY seconds without a usable answer the
+# next model is tried alongside, HEDGE_FAN_OUT models start at once.
+HEDGE_DELAY = config("HEDGE_DELAY", default=10.0, cast=float)
+HEDGE_FAN_OUT = config("HEDGE_FAN_OUT", default=1, cast=int)
+CARD_MAX_WORKERS = config("CARD_MAX_WORKERS", default=8, cast=int)
+
+# Long texts are split into parts of at least this many words, each part
+# asking for its share of the cards in parallel
+GENERATION_CHUNK_WORDS = config("GENERATION_CHUNK_WORDS", default=300,
+                                cast=int)
+
+# At most this many earlier questions are quoted back in the prompt
+PROMPT_EXCLUSION_LIMIT = config("PROMPT_EXCLUSION_LIMIT", default=8, cast=int)
+PROMPT_QUESTION_CHARS = 120
+
+# "remote" asks BART, "fast" summarizes locally with TextRank and no API call
+SUMMARY_MODE = config("SUMMARY_MODE", default="remote")
+FAST_SUMMARY_WORDS = config("FAST_SUMMARY_WORDS", default=250, cast=int)
+# Chunks BART fails on, or has not answered within the budget, fall back to
+# a local extractive summary of about EXTRACTIVE_CHUNK_WORDS words
+EXTRACTIVE_FALLBACK = config("EXTRACTIVE_FALLBACK", default=True, cast=bool)
+SUMMARY_LATENCY_BUDGET = config("SUMMARY_LATENCY_BUDGET", default=20.0,
+                                cast=float)
+EXTRACTIVE_CHUNK_WORDS = 120
+
+# "llm" asks OpenRouter, "instant" builds cloze cards locally. With the
+# fallback on, local cards fill in whatever the models failed to produce.
+GENERATION_MODE = config("GENERATION_MODE", default="llm")
+LOCAL_CARD_FALLBACK = config("LOCAL_CARD_FALLBACK", default=True, cast=bool)
+
+# Map-reduce mode for documents longer than MAX_CHUNKS
+SUMMARY_MAP_REDUCE = config("SUMMARY_MAP_REDUCE", default=True, cast=bool)
+MAP_REDUCE_MAX_DEPTH = config("MAP_REDUCE_MAX_DEPTH", default=4, cast=int)
+MAP_REDUCE_FAN_OUT = config("MAP_REDUCE_FAN_OUT", default=4, cast=int)
+MAP_REDUCE_MAX_CHUNKS = config("MAP_REDUCE_MAX_CHUNKS", default=256, cast=int)
+
+
+def _iter_sentences(text):
+    """Yield (sentence words, ends paragraph) pairs in document order"""
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        sentences = [sentence.split() for sentence in
+                     SENTENCE_BREAK.split(paragraph)]
+        sentences = [words for words in sentences if words]
+        for i, words in enumerate(sentences):
+            yield words, i == len(sentences) - 1
+
+
+def _split_long_word(word, max_chars):
+    return [word[i:i + max_chars] for i in range(0, len(word), max_chars)]
+
+
+def iter_chunks(text, max_words=MAX_WORDS_PER_CHUNK,
+                max_chars=MAX_CHARS_PER_CHUNK):
+    """Lazily yield chunks that end on sentence or paragraph boundaries
+
+    Word and character counts are tracked incrementally, so each chunk is
+    joined exactly once. Sentences longer than a whole chunk fall back to
+    word boundaries.
+    """
+    current = []
+    words = chars = 0
+
+    for sentence, ends_paragraph in _iter_sentences(text):
+        length = sum(len(word) for word in sentence) + len(sentence) - 1
+
+        # Close the chunk before a sentence that would not fit in it
+        if current and (words + len(sentence) > max_words or
+                        chars + 1 + length > max_chars):
+            yield ' '.join(current)
+            current = []
+            words = chars = 0
+
+        if len(sentence) <= max_words and length <= max_chars:
+            chars += length + 1 if current else length
+            words += len(sentence)
+            current.extend(sentence)
+        else:
+            for word in sentence:
+                pieces = [word] if len(word) <= max_chars else \
+                    _split_long_word(word, max_chars)
+                for piece in pieces:
+                    if current and (words + 1 > max_words or
+                                    chars + 1 + len(piece) > max_chars):
+                        yield ' '.join(current)
+                        current = []
+                        words = chars = 0
+                    chars += len(piece) + 1 if current else len(piece)
+                    words += 1
+                    current.append(piece)
+
+        # Prefer to stop at the end of a paragraph once the chunk is mostly full
+        if ends_paragraph and (words >= max_words * PARAGRAPH_FILL or
+                               chars >= max_chars * PARAGRAPH_FILL):
+            yield ' '.join(current)
+            current = []
+            words = chars = 0
+
+    if current:
+        yield ' '.join(current)
 
 
 def chunk_text(text):
-    words = text.split()
-    chunks = []
-    current_chunk = []
+    return list(islice(iter_chunks(text), MAX_CHUNKS))
 
-    for word in words:
-        current_chunk.append(word)
-        chunk_str = ' '.join(current_chunk)
-        if len(current_chunk) >= MAX_WORDS_PER_CHUNK or len(
-                chunk_str) >= MAX_CHARS_PER_CHUNK:
-            if len(current_chunk) > MAX_WORDS_PER_CHUNK or len(
-                    chunk_str) > MAX_CHARS_PER_CHUNK:
-                half1, half2 = split_chunk_safely(chunk_str)
-                chunks.extend([half1, half2])
-            else:
-                chunks.append(chunk_str)
-            current_chunk = []
 
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
+def extractive_summary(text, max_words=FAST_SUMMARY_WORDS):
+    """Local TextRank summary, no API call"""
+    sentences = [' '.join(words) for words, _ in _iter_sentences(text)]
+    return extractive.summarize_sentences(sentences, max_words)
 
-    return chunks[:MAX_CHUNKS]
 
+def fits_one_window(text):
+    return len(list(islice(iter_chunks(text), 2))) <= 1
 
-def call_bart_api(text):
-    response = requests.post(HUGGINGFACE_API_URL, headers=headers,
-                             json={"inputs": text})
-    if response.status_code == 200:
-        return response.json()[0]['summary_text']
-    return "Error: API call failed."
 
+# The sync entry points below run the single implementation in async_utils,
+# which imports this module's helpers and so is imported late.
 
-def summarize_text(text):
-    chunks = chunk_text(text)
-    summaries = []
+def summarize_chunks(chunks, budget=SUMMARY_LATENCY_BUDGET,
+                     fallback=EXTRACTIVE_FALLBACK):
+    """Summarize chunks concurrently, see async_utils.asummarize_chunks"""
+    from .async_utils import asummarize_chunks
+    return async_to_sync(asummarize_chunks)(chunks, budget, fallback)
 
-    for i, chunk in enumerate(chunks[:MAX_CHUNKS]):
-        summary = call_bart_api(chunk)
-        summaries.append(summary)
 
-    final_summary = "\n\n".join(summaries)
+def map_reduce_summarize(text, max_depth=MAP_REDUCE_MAX_DEPTH,
+                         fan_out=MAP_REDUCE_FAN_OUT,
+                         budget=SUMMARY_LATENCY_BUDGET):
+    """Summarize a long document in rounds, see amap_reduce_summarize"""
+    from .async_utils import amap_reduce_summarize
+    return async_to_sync(amap_reduce_summarize)(text, max_depth, fan_out,
+                                                budget)
 
-    return final_summary
 
+def summarize_text(text, map_reduce=SUMMARY_MAP_REDUCE, mode=SUMMARY_MODE):
+    from .async_utils import asummarize_text
+    return async_to_sync(asummarize_text)(text, map_reduce, mode)
 
-def get_free_models() -> List[str]:
-    """Fetch available free models from OpenRouter"""
-    try:
-        response = requests.get("https://openrouter.ai/api/v1/models",
-                                timeout=10)
-        response.raise_for_status()
-        models_data = response.json()
-
-        # Filter for free models (pricing.prompt = 0 and pricing.completion = 0)
-        free_models = []
-        for model in models_data.get('data', []):
-            pricing = model.get('pricing', {})
-            if (pricing.get('prompt') == '0' or pricing.get('prompt') == 0) and \
-                    (pricing.get('completion') == '0' or pricing.get(
-                        'completion') == 0):
-                free_models.append(model['id'])
-
-        return free_models
-
-    except Exception as e:
-        # Fallback to some known free models
-        return [
-            "meta-llama/llama-3.2-1b-instruct:free",
-            "meta-llama/llama-3.2-3b-instruct:free",
-            "microsoft/phi-3-mini-128k-instruct:free",
-            "google/gemma-2-9b-it:free",
-            "qwen/qwen-2-7b-instruct:free"
-        ]
 
-
-def create_cards(text: str, number: int, models: List[str],
-                 existing_questions: List[str]) -> Optional[
-    List[Tuple[str, str]]]:
-    """Try to create cards using available models, avoiding duplicate questions"""
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Authorization": "Bearer " + OR_API,
-        "Content-Type": "application/json"
-    }
+def build_card_prompt(text: str, number: int,
+                      existing_questions: List[str]) -> str:
+    # Duplicates are filtered locally, so the prompt only needs a short hint
+    existing_questions = [question[:PROMPT_QUESTION_CHARS] for question in
+                          existing_questions[-PROMPT_EXCLUSION_LIMIT:]]
 
     # Build the existing questions context
     existing_context = ""
     if existing_questions:
         existing_context = f"\n\nIMPORTANT: Do NOT create questions similar to these already created questions: {'; '.join(existing_questions)}. Make sure your questions cover DIFFERENT aspects of the text."
 
-    prompt = f"""Create {number} question answer pairs based on the text at the bottom. 
+    return f"""Create {number} question answer pairs based on the text at the bottom. 
 Format them EXACTLY in this way: 
 |Question? $$ Answer|
 |Question? $$ Answer|
@@ -124,99 +202,247 @@ from the answer with two dollar signs. There should be {number * 2} | and
 
 This is the text to base the questions on: {text}"""
 
-    for model in models:
-        data = {
-            "model": model,
-            "messages": [{"role": "user", "content": prompt}],
-            "max_tokens": 2000,
-            "temperature": 0.8
-        }
 
-        try:
-            response = requests.post(url, headers=headers, json=data,
-                                     timeout=45)
-            response.raise_for_status()
-            response_json = response.json()
+def openrouter_headers() -> dict:
+    return {
+        "Authorization": "Bearer " + OR_API,
+        "Content-Type": "application/json"
+    }
 
-            # Check for API errors
-            if "error" in response_json:
-                continue
 
-            if "choices" not in response_json or not response_json["choices"]:
-                continue
+def card_request_body(model: str, prompt: str, stream: bool = False) -> dict:
+    data = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 2000,
+        "temperature": 0.8
+    }
+    if stream:
+        data["stream"] = True
+    return data
 
-            content = response_json["choices"][0]["message"]["content"]
 
-            # Parse the content
-            if "|" not in content or "$$" not in content:
-                continue
+def completion_content(response_json: dict) -> Optional[str]:
+    """The message text of a chat completion, None if the API reported an error"""
+    # Check for API errors
+    if "error" in response_json:
+        return None
 
-            qnaextra = content.split("|")
-            qna = [item for item in qnaextra if "$$" in item]
+    if "choices" not in response_json or not response_json["choices"]:
+        return None
+
+    return response_json["choices"][0]["message"]["content"]
 
-            if len(qna) < number:
-                continue
 
-            # Parse question-answer pairs
-            parsed_qna = []
-            for item in qna:
-                if "$$" in item:
-                    parts = item.split("$$", 1)
-                    if len(parts) == 2:
-                        question = parts[0].strip()
-                        answer = parts[1].strip()
-                        if question and answer:
-                            parsed_qna.append((question, answer))
+def parse_cards(content: str, number: int):
+    """Parse question/answer pairs, returning (cards, outcome)
 
-            if len(parsed_qna) >= number:
-                return parsed_qna[:number]
+    Accepts the pipe format and the usual slips (bare lines, Q:/A: labels,
+    numbered lists). Fewer than `number` cards still count as a success so
+    that only the missing ones are asked for again.
+    """
+    cards = parsing.parse_completion(content, number)
+    if not cards:
+        return None, scoreboard.PARSE_FAILURE
+    return cards, scoreboard.SUCCESS
 
-        except:
-            continue
 
-        time.sleep(1)
+def create_cards(text: str, number: int, models: List[str],
+                 existing_questions: List[str],
+                 hedge_delay: Optional[float] = HEDGE_DELAY,
+                 fan_out: int = HEDGE_FAN_OUT) -> Optional[
+    List[Tuple[str, str]]]:
+    """Race models for cards, see async_utils.acreate_cards"""
+    from .async_utils import acreate_cards
+    return async_to_sync(acreate_cards)(text, number, models,
+                                        existing_questions, hedge_delay,
+                                        fan_out)
 
-    return None
 
+class CardStreamParser:
+    """Incrementally extract |Question $$ Answer| pairs from streamed text
 
-def generate_flashcards(text: str, number: int) -> Optional[
-    List[Tuple[str, str]]]:
-    """Generate flashcards with automatic model switching and duplicate prevention"""
-    if not (0 < number < 7):
-        return None
+    Uses the pipe rule of core.parsing, splitting on pipes and keeping the
+    pieces that contain $$, but only emits a pair once its closing pipe has
+    arrived. Other formats are salvaged from the full text at the end.
+    """
 
-    # Get available free models
-    available_models = get_free_models()
-    if not available_models:
-        return None
+    def __init__(self):
+        self.buffer = ""
 
-    cards = []
-    existing_questions = []
-    remaining = number
-    max_attempts = 3
-
-    for attempt in range(max_attempts):
-        while remaining > 0:
-            # Use original chunking logic
-            num_to_generate = remaining // 2 if remaining > 3 else remaining
-
-            new_cards = create_cards(text, num_to_generate, available_models,
-                                     existing_questions)
-
-            if new_cards:
-                # Add new questions to tracking list
-                for question, answer in new_cards:
-                    existing_questions.append(question)
-
-                cards.extend(new_cards)
-                remaining -= len(new_cards)
-            else:
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        self.buffer += text
+        pairs = []
+
+        while True:
+            start = self.buffer.find("|")
+            if start == -1:
+                self.buffer = ""
+                break
+            end = self.buffer.find("|", start + 1)
+            if end == -1:
+                self.buffer = self.buffer[start:]
                 break
 
-        if remaining == 0:
-            return cards
-        else:
-            available_models = get_free_models()
-            time.sleep(2)
+            item = self.buffer[start + 1:end]
+            if "$$" in item:
+                question, answer = (part.strip()
+                                    for part in item.split("$$", 1))
+                if question and answer:
+                    pairs.append((question, answer))
+
+            # The closing pipe may also open the next pair
+            self.buffer = self.buffer[end:]
 
+        return pairs
+
+
+def _stream_completion(model: str, prompt: str) -> Iterator[str]:
+    """Yield the content deltas of a streamed OpenRouter chat completion"""
+    data = card_request_body(model, prompt, stream=True)
+
+    # The caller takes the rate limit token for the first attempt
+    with request_with_backoff('openrouter', OR_API, 'POST',
+                              OPENROUTER_CHAT_URL, acquired=True,
+                              headers=openrouter_headers(), json=data,
+                              stream=True, timeout=45) as response:
+        response.raise_for_status()
+        response.encoding = "utf-8"
+
+        for line in response.iter_lines(decode_unicode=True):
+            # Skip keep-alive comments such as ": OPENROUTER PROCESSING"
+            if not line or not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                return
+
+            event = json.loads(payload)
+            if "error" in event:
+                raise ValueError(event["error"])
+            for choice in event.get("choices", []):
+                content = choice.get("delta", {}).get("content")
+                if content:
+                    yield content
+
+
+def stream_flashcards(text: str, number: int,
+                      models: Optional[List[str]] = None,
+                      known_questions: Iterable[str] = ()
+                      ) -> Iterator[Tuple[str, str]]:
+    """Yield flashcards one by one while the model is still writing them
+
+    If a model fails partway through, the next one is only asked for the
+    cards that are still missing. Near-duplicate questions are skipped, and
+    local cards fill in whatever no model delivered.
+    """
+    if not (0 < number < 7):
+        return
+
+    cards = []
+    known_questions = list(known_questions)
+    duplicates = DuplicateIndex(known_questions)
+    for model in scoreboard.rank_models(models or get_free_models()):
+        parser = CardStreamParser()
+        prompt = build_card_prompt(text, number - len(cards),
+                                   [question for question, _ in cards])
+        try:
+            acquire('openrouter', OR_API)
+        except RateLimitExceeded:
+            # Every model shares the provider's bucket, stop asking
+            break
+        started = time.monotonic()
+        outcome = scoreboard.PARSE_FAILURE
+        transcript = []
+        try:
+            for content in _stream_completion(model, prompt):
+                transcript.append(content)
+                for card in duplicates.filter_new(parser.feed(content)):
+                    outcome = scoreboard.SUCCESS
+                    cards.append(card)
+                    yield card
+                    if len(cards) >= number:
+                        return
+
+            # The model finished short, keep whatever else it wrote in
+            # another format before asking the next one
+            missing = number - len(cards)
+            salvaged = duplicates.filter_new(parsing.parse_completion(
+                ''.join(transcript), missing)) if missing else []
+            for card in salvaged[:missing]:
+                outcome = scoreboard.SUCCESS
+                cards.append(card)
+                yield card
+            if len(cards) >= number:
+                return
+        except RateLimitExceeded:
+            outcome = None
+        except Exception:
+            outcome = scoreboard.ERROR
+        finally:
+            if outcome is not None:
+                scoreboard.record(model, outcome, time.monotonic() - started)
+
+    if LOCAL_CARD_FALLBACK:
+        yield from local_flashcards(
+            text, number - len(cards),
+            known_questions + [question for question, _ in cards])
+
+
+def plan_generation(text: str, number: int) -> List[Tuple[str, int]]:
+    """Split the text into parts and give each part a share of the cards
+
+    Short texts stay a single request. Longer ones are chunked into at most
+    `number` parts of up to MAX_WORDS_PER_CHUNK words, sampled evenly across
+    the document when it is longer than that, and the cards are shared out
+    by word count using largest remainders.
+    """
+    words = len(text.split())
+    part_words = min(MAX_WORDS_PER_CHUNK,
+                     max(GENERATION_CHUNK_WORDS, -(-words // number)))
+    parts = list(iter_chunks(text, max_words=part_words))
+    if len(parts) <= 1:
+        return [(text, number)]
+
+    if len(parts) > number:
+        step = len(parts) / number
+        parts = [parts[int(i * step)] for i in range(number)]
+
+    sizes = [len(part.split()) for part in parts]
+    total = sum(sizes)
+    shares = [number * size / total for size in sizes]
+    counts = [int(share) for share in shares]
+    by_remainder = sorted(range(len(parts)),
+                          key=lambda i: shares[i] - counts[i], reverse=True)
+    for i in by_remainder[:number - sum(counts)]:
+        counts[i] += 1
+
+    return [(part, count) for part, count in zip(parts, counts) if count]
+
+
+def generate_flashcards(text: str, number: int,
+                        on_progress: Optional[Callable[[float], None]] = None,
+                        known_questions: Iterable[str] = (),
+                        mode: str = GENERATION_MODE
+                        ) -> Optional[List[Tuple[str, str]]]:
+    """Generate flashcards, see async_utils.agenerate_flashcards"""
+    from .async_utils import agenerate_flashcards
+    return async_to_sync(agenerate_flashcards)(text, number, on_progress,
+                                               known_questions, mode)
+
+
+def local_flashcards(text: str, number: int,
+                     known_questions: Iterable[str] = ()
+                     ) -> List[Tuple[str, str]]:
+    """Cloze and definition cards built from the text, no API call"""
+    sentences = [' '.join(words) for words, _ in _iter_sentences(text)]
+    return cloze.make_cards(sentences, number, known_questions)
+
+
+def top_up_local_cards(cards, text, number, known_questions):
+    """Top up a short result with local cards when the fallback is on"""
+    if LOCAL_CARD_FALLBACK and len(cards) < number:
+        cards = cards + local_flashcards(
+            text, number - len(cards),
+            known_questions + [question for question, _ in cards])
     return cards if cards else None
@@ -1,56 +1,95 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from .utils import summarize_text, generate_flashcards
-from .models import FlashcardSet, Flashcard
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import (Http404, HttpResponse, HttpResponseNotModified,
+                         JsonResponse, StreamingHttpResponse)
+from django.core.exceptions import ValidationError
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_POST
+from asgiref.sync import sync_to_async
+from decouple import config
+from . import metrics, ratelimit, set_cache
+from .async_utils import agenerate_flashcards, asummarize_text
+from .catalog import catalog_age, get_free_models
+from .dedupe import saved_questions
+from .forms import FlashcardSetForm, validate_flashcards
+from .jobs import enqueue, job_to_dict
+from .pagination import MAX_PAGE_SIZE, SIDEBAR_PAGE_SIZE, flashcard_set_page
+from .quotas import (MAX_ACTIVE_JOBS, MAX_CONCURRENT_STREAMS,
+                     starts_upstream_work, user_quota)
+from .scoreboard import scoreboard
+from .search import search_cards
+from .summary_cache import summary_cache
+from .srs import apply_reviews, due_reviews
+from .models import FlashcardSet, Flashcard, Job
+from .utils import (BART_ERROR, GENERATION_MODE, SUMMARY_MODE,
+                    generate_flashcards, stream_flashcards, summarize_text)
 import json
 
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
+
+def _requested_cards(request) -> int:
+    """num_cards from the form, 0 unless it is a number from 1 to 6"""
+    try:
+        num_cards = int(request.POST.get('num_cards', 3))
+    except ValueError:
+        return 0
+    return num_cards if 0 < num_cards < 7 else 0
+
 
 @login_required(login_url='accounts/login')
+@user_quota('generation', active_jobs=MAX_ACTIVE_JOBS,
+            applies=starts_upstream_work)
 def core_view(request):
     submitted_text = request.POST.get('text_content', '')
     summary = ""
     flashcards = None
     summary_requested = False
     save_success = False
+    job = None
 
     if request.method == "POST":
-        if "summarize" in request.POST:
-            summary = summarize_text(submitted_text)
+        # Slow upstream work runs in the job worker, the page polls for it
+        if request.POST.get("summarize") == "fast":
+            # Local extractive summary, quick enough to answer inline
+            summary = summarize_text(submitted_text, mode="fast")
+            summary_requested = True
+        elif "summarize" in request.POST:
+            job = enqueue(request.user, Job.SUMMARIZE, text=submitted_text)
             summary_requested = True
         elif "generate_flashcard" in request.POST:
-            num_cards = int(request.POST.get('num_cards', 3))
-            flashcards = generate_flashcards(submitted_text, num_cards)
+            num_cards = _requested_cards(request)
+            if not num_cards:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Number of cards must be between 1 and 6.'
+                }, status=400)
+            if request.POST["generate_flashcard"] == "instant":
+                # Local cloze cards take milliseconds, so they skip the queue
+                flashcards = generate_flashcards(
+                    submitted_text, num_cards, mode="instant",
+                    known_questions=saved_questions(request.user))
+            else:
+                job = enqueue(request.user, Job.GENERATE_FLASHCARDS,
+                              text=submitted_text, num_cards=num_cards)
         elif "save_flashcards" in request.POST:
-            # Save flashcards functionality
-            flashcards_data = request.POST.get('flashcards_data')
-            set_title = request.POST.get('set_title', 'Untitled Set')
-
-            if flashcards_data:
-                try:
-                    flashcards_list = json.loads(flashcards_data)
-
-                    # Create flashcard set
-                    flashcard_set = FlashcardSet.objects.create(
-                        title=set_title,
-                        user=request.user
-                    )
-
-                    # Create individual flashcards
-                    for question, answer in flashcards_list:
-                        Flashcard.objects.create(
-                            flashcard_set=flashcard_set,
-                            question=question,
-                            answer=answer
-                        )
-
-                    save_success = True
-                    flashcards = flashcards_list  # Keep flashcards visible
-                except json.JSONDecodeError:
-                    save_success = False
-
-    # Get user's flashcard sets
-    flashcard_sets = FlashcardSet.objects.filter(user=request.user)
+            form = FlashcardSetForm(request.POST)
+            if form.is_valid():
+                flashcards_list = form.cleaned_data['flashcards_data']
+                FlashcardSet.objects.create_with_cards(
+                    request.user, form.cleaned_data['set_title'],
+                    flashcards_list)
+                save_success = True
+                flashcards = flashcards_list  # Keep flashcards visible
+
+    if job and request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({'success': True, 'job': job_to_dict(job)},
+                            status=202)
+
+    # First page of the user's flashcard sets, the rest load on demand
+    flashcard_sets, next_cursor = flashcard_set_page(request.user)
 
     context = {
         "submitted_text": submitted_text,
@@ -59,32 +98,76 @@ def core_view(request):
         "flashcards_json": json.dumps(flashcards) if flashcards else None,
         "summary_requested": summary_requested,
         "flashcard_sets": flashcard_sets,
+        "next_cursor": next_cursor,
         "save_success": save_success,
+        "job": job,
     }
     return render(request, "core/core.html", context)
 
 
+@login_required(login_url='accounts/login')
+def job_status(request, job_id):
+    """Report the state, progress and result of a background job"""
+    job = get_object_or_404(Job, id=job_id, user=request.user)
+    return JsonResponse({'success': True, 'job': job_to_dict(job)})
+
+
+def _load_flashcard_set_json(request, set_id):
+    """Serve a set's JSON from cache, or 304 if the client already has it
+
+    The version is read from the database on every request, one lookup by
+    primary key, so no worker serves a deleted or outdated set from its
+    own cache. Only the encoded payload is cached.
+    """
+    version = FlashcardSet.objects.filter(id=set_id).values(
+        'user_id', 'updated_at', 'title').first()
+    if version is None or version['user_id'] != request.user.id:
+        raise Http404("No FlashcardSet matches the given query.")
+    etag = set_cache.etag_for(set_id, version['updated_at'])
+    last_modified = version['updated_at'].timestamp()
+
+    if_none_match = request.headers.get('If-None-Match')
+    if_modified_since = parse_http_date_safe(
+        request.headers.get('If-Modified-Since', ''))
+    if (if_none_match and etag in if_none_match) or (
+            not if_none_match and if_modified_since and
+            if_modified_since >= int(last_modified)):
+        response = HttpResponseNotModified()
+    else:
+        payload = set_cache.get_payload(set_id, etag)
+        if payload is None:
+            flashcards = list(Flashcard.objects.filter(
+                flashcard_set_id=set_id).values_list('question', 'answer'))
+            payload = set_cache.build_payload(set_id, etag, version['title'],
+                                              flashcards)
+        response = HttpResponse(payload, content_type='application/json')
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    response['Vary'] = 'X-Requested-With, Cookie'
+    return response
+
+
 @login_required(login_url='accounts/login')
 def load_flashcard_set(request, set_id):
     """Load a specific flashcard set for studying"""
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        # AJAX request
+        return _load_flashcard_set_json(request, set_id)
+
     flashcard_set = get_object_or_404(FlashcardSet, id=set_id,
                                       user=request.user)
     flashcards = [(card.question, card.answer) for card in
                   flashcard_set.cards.all()]
 
-    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        # AJAX request
-        return JsonResponse({
-            'success': True,
-            'flashcards': flashcards,
-            'set_title': flashcard_set.title
-        })
-
     # Regular request - redirect back to main page with flashcards loaded
+    flashcard_sets, next_cursor = flashcard_set_page(request.user)
     context = {
         "flashcards": flashcards,
         "flashcards_json": json.dumps(flashcards),
-        "flashcard_sets": FlashcardSet.objects.filter(user=request.user),
+        "flashcard_sets": flashcard_sets,
+        "next_cursor": next_cursor,
         "loaded_set_title": flashcard_set.title,
     }
     return render(request, "core/core.html", context)
@@ -101,4 +184,239 @@ def delete_flashcard_set(request, set_id):
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({'success': True})
 
-    return redirect('core')
\ No newline at end of file
+    return redirect('core')
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@login_required(login_url='accounts/login')
+@require_POST
+@user_quota('generation', concurrency=MAX_CONCURRENT_STREAMS)
+def stream_flashcard_generation(request):
+    """Stream flashcards to the browser as Server-Sent Events"""
+    submitted_text = request.POST.get('text_content', '')
+    num_cards = _requested_cards(request)
+    if not submitted_text.strip() or not num_cards:
+        return JsonResponse({'success': False,
+                             'error': 'Invalid text or number of cards.'},
+                            status=400)
+
+    async def events():
+        # The ASGI server would buffer a sync generator until it finished,
+        # so each card is pulled off the loop and sent as soon as it exists
+        count = 0
+        known_questions = await sync_to_async(saved_questions)(request.user)
+        cards = stream_flashcards(submitted_text, num_cards,
+                                  known_questions=known_questions)
+        next_card = sync_to_async(next, thread_sensitive=False)
+        try:
+            while (card := await next_card(cards, None)) is not None:
+                count += 1
+                yield _sse('card', {'question': card[0], 'answer': card[1]})
+        finally:
+            await sync_to_async(cards.close, thread_sensitive=False)()
+        yield _sse('done', {'count': count})
+
+    response = StreamingHttpResponse(events(),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required(login_url='accounts/login')
+@require_POST
+@user_quota('generation', concurrency=MAX_CONCURRENT_STREAMS)
+async def summarize_api(request):
+    """Summarize in the request itself, awaiting BART without a thread"""
+    submitted_text = request.POST.get('text_content', '')
+    if not submitted_text.strip():
+        return JsonResponse({'success': False, 'error': 'No text given.'},
+                            status=400)
+
+    summary = await asummarize_text(
+        submitted_text, mode=request.POST.get('mode', SUMMARY_MODE))
+    if summary == BART_ERROR:
+        return JsonResponse({'success': False, 'error': summary}, status=502)
+    return JsonResponse({'success': True, 'summary': summary})
+
+
+@login_required(login_url='accounts/login')
+@require_POST
+@user_quota('generation', concurrency=MAX_CONCURRENT_STREAMS)
+async def generate_api(request):
+    """Generate flashcards in the request itself, for ASGI deployments"""
+    submitted_text = request.POST.get('text_content', '')
+    num_cards = _requested_cards(request)
+    if not submitted_text.strip() or not num_cards:
+        return JsonResponse({'success': False,
+                             'error': 'Invalid text or number of cards.'},
+                            status=400)
+
+    user = await request.auser()
+    known_questions = await sync_to_async(saved_questions)(user)
+    flashcards = await agenerate_flashcards(
+        submitted_text, num_cards, known_questions=known_questions,
+        mode=request.POST.get('mode', GENERATION_MODE))
+    if not flashcards:
+        return JsonResponse({'success': False,
+                             'error': 'Could not generate flashcards.'},
+                            status=502)
+    return JsonResponse({'success': True, 'flashcards': flashcards})
+
+
+@staff_member_required
+def model_status(request):
+    """Catalog age, model scoreboard, summary cache and rate-limit stats"""
+    return JsonResponse({
+        'catalog_age': catalog_age(),
+        'models': scoreboard(get_free_models()),
+        'rate_limits': ratelimit.stats(),
+        'summary_cache': summary_cache.stats(),
+    })
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint for this process's metrics
+
+    Scrapers authenticate with METRICS_TOKEN as a bearer token; without a
+    token configured only staff sessions can read it.
+    """
+    authorization = request.headers.get('Authorization', '')
+    if METRICS_TOKEN:
+        allowed = constant_time_compare(authorization,
+                                        f"Bearer {METRICS_TOKEN}")
+    else:
+        allowed = request.user.is_staff
+    if not allowed:
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.render(),
+                        content_type='text/plain; version=0.0.4')
+
+
+@login_required(login_url='accounts/login')
+def flashcard_sets_api(request):
+    """GET lists the user's sets a page at a time, POST saves a new set"""
+    if request.method == "POST":
+        return _save_flashcard_set(request)
+
+    try:
+        limit = min(int(request.GET.get('limit', SIDEBAR_PAGE_SIZE)),
+                    MAX_PAGE_SIZE)
+        flashcard_sets, next_cursor = flashcard_set_page(
+            request.user, request.GET.get('cursor'), max(limit, 1))
+    except ValueError:
+        return JsonResponse({'success': False,
+                             'error': 'Invalid cursor or limit.'}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'sets': [{
+            'id': flashcard_set.id,
+            'title': flashcard_set.title,
+            'card_count': flashcard_set.card_count,
+            'created_at': flashcard_set.created_at.isoformat(),
+            'updated_at': flashcard_set.updated_at.isoformat(),
+        } for flashcard_set in flashcard_sets],
+        'next_cursor': next_cursor,
+    })
+
+
+def _save_flashcard_set(request):
+    """Save a set from a JSON body: {"title": ..., "flashcards": [[q, a]]}"""
+    try:
+        data = json.loads(request.body)
+        title = str(data.get('title') or 'Untitled Set')[:200]
+        flashcards = validate_flashcards(data.get('flashcards'))
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({'success': False, 'error': 'Invalid JSON body.'},
+                            status=400)
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'error': e.messages[0]},
+                            status=400)
+
+    flashcard_set = FlashcardSet.objects.create_with_cards(
+        request.user, title, flashcards)
+    return JsonResponse({'success': True, 'set_id': flashcard_set.id,
+                         'count': len(flashcards)}, status=201)
+
+
+@login_required(login_url='accounts/login')
+def search_flashcards(request):
+    """Ranked full-text search over the user's questions and answers"""
+    query = request.GET.get('q', '')
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid page.'},
+                            status=400)
+
+    results, has_next = search_cards(request.user, query, page)
+    return JsonResponse({
+        'success': True,
+        'query': query,
+        'page': page,
+        'has_next': has_next,
+        'results': results,
+    })
+
+
+MAX_DUE_CARDS = 200
+MAX_REVIEWS_PER_REQUEST = 1000
+
+
+@login_required(login_url='accounts/login')
+def due_cards(request):
+    """The next due cards for a study session, optionally within one set"""
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), MAX_DUE_CARDS)
+        set_id = request.GET.get('set')
+        set_id = int(set_id) if set_id else None
+    except ValueError:
+        return JsonResponse({'success': False,
+                             'error': 'Invalid limit or set.'}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'cards': [{
+            'card_id': review.card_id,
+            'question': review.card.question,
+            'answer': review.card.answer,
+            'due_at': review.due_at.isoformat(),
+            'interval_days': review.interval_days,
+            'repetitions': review.repetitions,
+        } for review in due_reviews(request.user, limit, set_id)],
+    })
+
+
+@login_required(login_url='accounts/login')
+@require_POST
+def submit_reviews(request):
+    """Record a batch of grades: {"reviews": [{"card_id": 1, "grade": 4}]}"""
+    try:
+        reviews = json.loads(request.body)['reviews']
+        grades = {int(review['card_id']): int(review['grade'])
+                  for review in reviews}
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+        return JsonResponse({'success': False, 'error': 'Invalid JSON body.'},
+                            status=400)
+
+    if not grades or len(grades) > MAX_REVIEWS_PER_REQUEST:
+        return JsonResponse({
+            'success': False,
+            'error': f'Send between 1 and {MAX_REVIEWS_PER_REQUEST} reviews.'
+        }, status=400)
+    if any(not 0 <= grade <= 5 for grade in grades.values()):
+        return JsonResponse({'success': False,
+                             'error': 'Grades must be between 0 and 5.'},
+                            status=400)
+
+    updated = apply_reviews(request.user, grades)
+    return JsonResponse({
+        'success': True,
+        'updated': len(updated),
+        'next_due': {review.card_id: review.due_at.isoformat()
+                     for review in updated},
+    })